@@ -0,0 +1,272 @@
+#!/usr/bin/env python2
+"""Simulates collaborators editing scenes, measuring the editor's latency.
+
+Editors log in, then repeatedly lock an object, move it around and unlock it.
+Every message carries the time it was sent at, so that all simulated clients
+can measure how long the server took to deliver it. The accounts must be able
+to edit the scenes and viewers need the scenes to be public. Example:
+
+  ./bench.py --url=http://localhost:8000 --scenes=1,2 --editors=4 \\
+             --viewers=20 --accounts=bench@shapy.io:secret --spawn
+"""
+
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib
+
+import tornado.httpclient
+import tornado.ioloop
+import tornado.websocket
+from tornado.gen import Return, coroutine, sleep
+from tornado.options import define, options
+
+from shapy import protocol
+
+
+define('url', default='http://localhost:8000', help='Address of the server')
+define('scenes', default='1', help='Comma separated IDs of the scenes')
+define('editors', default=4, help='Number of editors per scene')
+define('viewers', default=16, help='Number of viewers per scene')
+define('accounts', default='', help='Comma separated email:password pairs')
+define('duration', default=30.0, help='Duration of the benchmark in seconds')
+define('rate', default=10.0, help='Edits per second sent by each editor')
+define('edits', default=5, help='Edits applied to an object while locked')
+define('protocol', default=protocol.JSON, help='WebSocket subprotocol')
+define('spawn', default=False, help='Starts web.py, measuring its memory')
+
+
+
+class Stats(object):
+  """Collects the delivery latencies of messages."""
+
+  def __init__(self):
+    """Creates empty counters."""
+
+    self.sent = 0
+    self.received = 0
+    self.latencies = []
+    self.types = collections.Counter()
+
+  def percentile(self, p):
+    """Returns a percentile of the latencies, in milliseconds."""
+
+    if not self.latencies:
+      return 0.0
+    latencies = sorted(self.latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+
+
+class Client(object):
+  """Simulated user connected to a scene."""
+
+  def __init__(self, stats, scene_id, cookie=None):
+    """Creates a client, connecting as a user if a cookie is given."""
+
+    self.stats = stats
+    self.scene_id = scene_id
+    self.cookie = cookie
+    self.conn = None
+
+  @coroutine
+  def connect(self):
+    """Opens the websocket & starts receiving messages."""
+
+    headers = { 'Sec-WebSocket-Protocol': options.protocol }
+    if self.cookie:
+      headers['Cookie'] = self.cookie
+    self.conn = yield tornado.websocket.websocket_connect(
+        tornado.httpclient.HTTPRequest(
+            '%s/api/edit/%s' % (options.url.replace('http', 'ws', 1),
+                                self.scene_id),
+            headers=headers))
+    self.receive_()
+
+  @coroutine
+  def receive_(self):
+    """Records the latency of every received message."""
+
+    while True:
+      message = yield self.conn.read_message()
+      if message is None:
+        return
+
+      now = time.time()
+      data = protocol.decode(options.protocol, message)
+      self.stats.received += 1
+      self.stats.types[data.get('type')] += 1
+      if 'sent' in data:
+        self.stats.latencies.append(now - data['sent'])
+
+  def send(self, data):
+    """Sends a message, stamping it with the current time."""
+
+    data['sent'] = time.time()
+    payload, binary = protocol.encode(options.protocol, data)
+    self.conn.write_message(payload, binary=binary)
+    self.stats.sent += 1
+
+  @coroutine
+  def edit(self, user_id, deadline):
+    """Locks, moves & unlocks objects until the deadline."""
+
+    delay = 1.0 / options.rate
+    while time.time() < deadline:
+      obj = 'bench_%d_%d' % (user_id, random.randint(0, 9))
+      self.send({ 'type': 'lock', 'objects': [obj] })
+      for _ in range(options.edits):
+        yield sleep(delay)
+        self.send({
+          'type': 'edit',
+          'tool': 'translate',
+          'userId': user_id,
+          'objMode': True,
+          'ids': [obj],
+          'dx': random.uniform(-1, 1),
+          'dy': random.uniform(-1, 1),
+          'dz': random.uniform(-1, 1)
+        })
+      self.send({ 'type': 'unlock', 'objects': [obj] })
+      yield sleep(delay)
+
+  def close(self):
+    """Closes the connection."""
+
+    if self.conn:
+      self.conn.close()
+
+
+
+@coroutine
+def login(email, passw):
+  """Logs in, returning the session cookie & the user ID."""
+
+  client = tornado.httpclient.AsyncHTTPClient()
+  response = yield client.fetch(
+      '%s/api/user/login' % options.url,
+      method='POST',
+      body=json.dumps({ 'email': email, 'passw': passw }))
+  cookie = response.headers['Set-Cookie'].split(';')[0]
+
+  response = yield client.fetch(
+      '%s/api/user/filter?%s' % (options.url, urllib.urlencode({
+        'email': email
+      })))
+  for user in json.loads(response.body):
+    if user['email'] == email:
+      raise Return((cookie, user['id']))
+  raise ValueError('Unknown user %s' % email)
+
+
+def memory(pid):
+  """Returns the resident memory of a process & its children, in KiB."""
+
+  total = 0
+  for entry in os.listdir('/proc'):
+    if not entry.isdigit():
+      continue
+    try:
+      with open('/proc/%s/stat' % entry) as f:
+        ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+      if int(entry) != pid and ppid != pid:
+        continue
+      with open('/proc/%s/status' % entry) as f:
+        for line in f:
+          if line.startswith('VmRSS:'):
+            total += int(line.split()[1])
+    except (IOError, IndexError, ValueError):
+      continue
+  return total
+
+
+@coroutine
+def run(server):
+  """Connects all clients, runs the edits & prints a report."""
+
+  stats = Stats()
+  accounts = [
+    account.split(':', 1) for account in options.accounts.split(',') if account
+  ]
+  if options.editors and not accounts:
+    raise ValueError('Editors need --accounts to log in')
+  users = yield [login(email, passw) for email, passw in accounts]
+
+  # Connect everybody.
+  editors, viewers = [], []
+  for scene_id in options.scenes.split(','):
+    for i in range(options.editors):
+      cookie, user_id = users[i % len(users)]
+      editors.append((Client(stats, scene_id, cookie), user_id))
+    for i in range(options.viewers):
+      viewers.append(Client(stats, scene_id))
+  yield [client.connect() for client, _ in editors]
+  yield [client.connect() for client in viewers]
+  memory_idle = memory(server.pid) if server else 0
+
+  # Edit the scenes.
+  start = time.time()
+  yield [
+    client.edit(user_id, start + options.duration)
+    for client, user_id in editors
+  ]
+  yield sleep(1.0)
+  elapsed = time.time() - start
+  memory_busy = memory(server.pid) if server else 0
+
+  for client, _ in editors:
+    client.close()
+  for client in viewers:
+    client.close()
+
+  print 'clients:    %d editors, %d viewers' % (len(editors), len(viewers))
+  print 'sent:       %d (%.1f/s)' % (stats.sent, stats.sent / elapsed)
+  print 'delivered:  %d (%.1f/s)' % (stats.received, stats.received / elapsed)
+  print 'latency:    p50 %.1fms, p99 %.1fms' % (
+      stats.percentile(0.5), stats.percentile(0.99))
+  for type, count in sorted(stats.types.iteritems()):
+    print '  %-10s %d' % (type, count)
+  if server:
+    print 'memory:     %d KiB connected, %d KiB after edits' % (
+        memory_idle, memory_busy)
+
+
+@coroutine
+def wait_for_server():
+  """Waits until the server accepts requests."""
+
+  client = tornado.httpclient.AsyncHTTPClient()
+  for _ in range(50):
+    try:
+      yield client.fetch(options.url)
+      return
+    except Exception:
+      yield sleep(0.2)
+  raise RuntimeError('Server did not start')
+
+
+@coroutine
+def main():
+  """Runs the benchmark, starting the server if requested."""
+
+  server = None
+  if options.spawn:
+    server = subprocess.Popen([sys.executable, 'web.py'])
+  try:
+    if server:
+      yield wait_for_server()
+    yield run(server)
+  finally:
+    if server:
+      server.terminate()
+      server.wait()
+
+
+
+if __name__ == '__main__':
+  options.parse_command_line()
+  tornado.ioloop.IOLoop.instance().run_sync(main)
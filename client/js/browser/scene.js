@@ -52,6 +52,18 @@ shapy.browser.Scene = function(shBrowser, id , opt_data) {
    */
   this.nextID_ = 0;
 
+  /**
+   * Sequence number of the last operation applied to the scene.
+   * @public {number}
+   */
+  this.seq = 0;
+
+  /**
+   * True if the scene was changed in ways the server cannot reproduce.
+   * @public {boolean}
+   */
+  this.stale = false;
+
   // Set preview
   this.image = (opt_data && opt_data['preview']) || '/img/scene.svg';
 };
@@ -77,6 +89,7 @@ shapy.browser.Scene.prototype.load = function(data) {
   if (!data.data) {
     return;
   }
+  this.seq = data.data.seq || 0;
 
   this.objects = goog.object.map(data.data.objects || {}, function(data) {
     var obj = new shapy.editor.Object(
@@ -113,12 +126,25 @@ shapy.browser.Scene.prototype.load = function(data) {
  * @return {!angular.$q}
  */
 shapy.browser.Scene.prototype.save = function() {
-  return this.shBrowser_.http_.put('/api/assets/scene', {
+  // Previews are rendered by the server when the data changes.
+  var params = {
     id: this.id,
     name: this.name,
-    data: JSON.stringify(this.toJSON()),
-    preview: this.image
-  });
+    seq: this.seq
+  };
+
+  // The server applies most edits itself, so the objects are only uploaded
+  // if they were changed by a tool the server does not implement.
+  if (!this.stale) {
+    return this.shBrowser_.http_.put('/api/assets/scene', params);
+  }
+
+  this.stale = false;
+  params.data = JSON.stringify(this.toJSON());
+  return this.shBrowser_.http_.put('/api/assets/scene', params)
+      .error(goog.bind(function() {
+        this.stale = true;
+      }, this));
 };
 
 
@@ -140,6 +166,7 @@ shapy.browser.Scene.prototype.destroy = function() {
 shapy.browser.Scene.prototype.toJSON = function() {
   return {
     id: this.id,
+    seq: this.seq,
     objects: goog.object.map(this.objects, function(object) {
       return object.toJSON();
     })
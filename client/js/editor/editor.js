@@ -270,7 +270,7 @@ shapy.editor.Editor.prototype.snapshot_ = function() {
     }
   });
 
-  // Generate & save the preview.
+  // Update the preview shown by the browser until the server renders one.
   this.scene_.image = shapy.browser.Texture.preview(
     this.canvas_
   ).toDataURL('image/jpeg');
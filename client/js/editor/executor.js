@@ -3,6 +3,8 @@
 // (C) 2015 The Shapy Team. All rights reserved.
 goog.provide('shapy.editor.Executor');
 
+goog.require('shapy.msgpack');
+
 
 
 /**
@@ -28,20 +30,59 @@ shapy.editor.Executor = function(scene, editor, type) {
    */
   this.pending_ = [];
 
+  /**
+   * True once the connection was reopened to resume the current session.
+   * @private {boolean}
+   */
+  this.resumed_ = false;
+
   /**
    * WebSocket connection.
    * @private {WebSocket}
    */
-  this.sock_ = new WebSocket(goog.string.format('ws://%s:%d/api/edit/%s',
+  this.sock_ = null;
+  this.connect_();
+};
+
+
+/**
+ * Opens the connection, requesting the operations missing from the scene.
+ *
+ * @private
+ */
+shapy.editor.Executor.prototype.connect_ = function() {
+  this.sock_ = new WebSocket(goog.string.format(
+      'ws://%s:%d/api/edit/%s?seq=%d',
       this.editor_.location_.host(),
       this.editor_.location_.port(),
-      this.scene_.id));
+      this.scene_.id,
+      this.scene_.seq), [
+      shapy.editor.Executor.Protocol.MSGPACK,
+      shapy.editor.Executor.Protocol.JSON
+  ]);
+  this.sock_.binaryType = 'arraybuffer';
   this.sock_.onmessage = goog.bind(this.onMessage_, this);
   this.sock_.onclose = goog.bind(this.onClose_, this);
   this.sock_.onopen = goog.bind(this.onOpen_, this);
 };
 
 
+/**
+ * Drops the current connection and opens a new one.
+ *
+ * @private
+ */
+shapy.editor.Executor.prototype.reconnect_ = function() {
+  this.resumed_ = true;
+  if (this.sock_) {
+    this.sock_.onmessage = null;
+    this.sock_.onclose = null;
+    this.sock_.close();
+  }
+  this.connect_();
+};
+
+
 /**
  * Closes the connection.
  */
@@ -60,11 +101,27 @@ shapy.editor.Executor.prototype.destroy = function() {
  */
 shapy.editor.Executor.prototype.onOpen_ = function() {
   goog.array.map(this.pending_, function(message) {
-    this.sock_.send(JSON.stringify(message));
+    this.send_(message);
   }, this);
 };
 
 
+/**
+ * Sends a message, encoded in the protocol chosen by the server.
+ *
+ * @private
+ *
+ * @param {Object} data
+ */
+shapy.editor.Executor.prototype.send_ = function(data) {
+  if (this.sock_.protocol == shapy.editor.Executor.Protocol.MSGPACK) {
+    this.sock_.send(shapy.msgpack.encode(data));
+  } else {
+    this.sock_.send(JSON.stringify(data));
+  }
+};
+
+
 /**
  * Called when the server suspends the connection.
  *
@@ -88,7 +145,7 @@ shapy.editor.Executor.prototype.sendCommand = function(data) {
     return;
   }
 
-  this.sock_.send(JSON.stringify(data));
+  this.send_(data);
 };
 
 
@@ -104,91 +161,154 @@ shapy.editor.Executor.prototype.onMessage_ = function(evt) {
 
   // Try to make sense of the data.
   try {
-    data = JSON.parse(evt.data);
+    if (evt.data instanceof ArrayBuffer) {
+      data = shapy.msgpack.decode(new Uint8Array(evt.data));
+    } else {
+      data = JSON.parse(evt.data);
+    }
   } catch (e) {
     console.error('Invalid message: ' + evt.data);
   }
 
   this.editor_.rootScope_.$apply(goog.bind(function() {
-    switch (data['type']) {
-      case 'message': this.applyMessage(data); return;
-      case 'create': this.applyCreate(data); return;
-      case 'lock': this.applyLock(data); return;
-      case 'unlock': this.applyUnlock(data); return;
-      case 'leave': this.applyLeave(data); return;
-      case 'name': {
-        if (this.scene_.name != data['value']) {
-          this.scene_.name = data['value'];
-        }
-        break;
+    this.dispatch_(data);
+  }, this));
+};
+
+
+/**
+ * Applies a message received from the server.
+ *
+ * @private
+ *
+ * @param {!Object} data
+ */
+shapy.editor.Executor.prototype.dispatch_ = function(data) {
+  // Keep track of the last operation applied to the scene.
+  if (data['seq'] > this.scene_.seq) {
+    this.scene_.seq = data['seq'];
+  }
+
+  // The server cannot apply some edits, so the scene must be uploaded.
+  var tools = shapy.editor.Executor.CLIENT_TOOLS;
+  if (data['type'] == 'create' ||
+      (data['type'] == 'edit' && goog.array.contains(tools, data['tool']))) {
+    this.scene_.stale = true;
+  }
+
+  switch (data['type']) {
+    case 'message': this.applyMessage(data); return;
+    case 'create': this.applyCreate(data); return;
+    case 'lock': this.applyLock(data); return;
+    case 'locks': this.applyLocks(data); return;
+    case 'unlock': this.applyUnlock(data); return;
+    case 'leave': this.applyLeave(data); return;
+    case 'name': {
+      if (this.scene_.name != data['value']) {
+        this.scene_.name = data['value'];
       }
-      case 'join': {
-        this.scene_.addUser(data['user']);
+      break;
+    }
+    case 'join': {
+      this.scene_.addUser(data['user']);
+      break;
+    }
+    case 'meta': {
+      this.scene_.setUsers(data['users']);
+      break;
+    }
+    case 'stale': {
+      // The server lost track of the scene, so it must be uploaded.
+      this.scene_.stale = true;
+      break;
+    }
+    case 'replay': {
+      // Edits made before loading the page are applied regardless of their
+      // author. After a reconnect, the user's own edits were applied already.
+      goog.array.forEach(data['ops'], function(op) {
+        if (!this.resumed_) {
+          delete op['userId'];
+        }
+        this.dispatch_(op);
+      }, this);
+      break;
+    }
+    case 'resync': {
+      // Messages were dropped by the server, replay them from the log.
+      if (!goog.isDef(data['snapshot'])) {
+        this.reconnect_();
         break;
       }
-      case 'meta': {
-        this.scene_.setUsers(data['users']);
-        break;
+
+      // Operations were discarded, reload if a newer snapshot exists.
+      if (data['snapshot'] > this.scene_.seq) {
+        window.location.reload();
+      } else {
+        this.editor_.shNotify_.warning({
+          text: 'Some changes could not be recovered.',
+          dismiss: 5000
+        });
       }
-      case 'edit': {
-        switch (data['tool']) {
-          case 'translate': {
-            this.applyTranslate(data);
-            break;
-          }
-          case 'rotate': {
-            this.applyRotate(data);
-            break;
-          }
-          case 'scale': {
-            this.applyScale(data);
-            break;
-          }
-          case 'delete': {
-            this.applyDelete(data);
-            break;
-          }
-          case 'extrude': {
-            this.applyExtrude(data);
-            break;
-          }
-          case 'connect': {
-            this.applyConnect(data);
-            break;
-          }
-          case 'merge': {
-            this.applyMerge(data);
-            break;
-          }
-          case 'paint': {
-            this.applyPaint(data);
-            break;
-          }
-          case 'texture': {
-            this.applyTexture(data);
-            break;
-          }
-          case 'weld': {
-            this.applyWeld(data);
-            break;
-          }
-          case 'moveUV': {
-            this.applyMoveUV(data);
-            break;
-          }
-          default: {
-            console.error('Invalid tool "' + data['tool'] + "'");
-            break;
-          }
+      break;
+    }
+    case 'edit': {
+      switch (data['tool']) {
+        case 'translate': {
+          this.applyTranslate(data);
+          break;
+        }
+        case 'rotate': {
+          this.applyRotate(data);
+          break;
+        }
+        case 'scale': {
+          this.applyScale(data);
+          break;
+        }
+        case 'delete': {
+          this.applyDelete(data);
+          break;
+        }
+        case 'extrude': {
+          this.applyExtrude(data);
+          break;
+        }
+        case 'connect': {
+          this.applyConnect(data);
+          break;
+        }
+        case 'merge': {
+          this.applyMerge(data);
+          break;
+        }
+        case 'paint': {
+          this.applyPaint(data);
+          break;
+        }
+        case 'texture': {
+          this.applyTexture(data);
+          break;
+        }
+        case 'weld': {
+          this.applyWeld(data);
+          break;
+        }
+        case 'moveUV': {
+          this.applyMoveUV(data);
+          break;
+        }
+        default: {
+          console.error('Invalid tool "' + data['tool'] + "'");
+          break;
         }
-        break;
-      }
-      default: {
-        console.error('Invalid message type "' + data['type'] + '"');
-        break;
       }
+      break;
     }
-  }, this));
+    default: {
+      console.error('Invalid message type "' + data['type'] + '"');
+      break;
+    }
+  }
 };
 
 
@@ -306,6 +426,27 @@ shapy.editor.Executor.prototype.applyLock = function(data) {
 };
 
 
+/**
+ * Handles the snapshot of all locks held when joining.
+ *
+ * @param {!Object} data
+ */
+shapy.editor.Executor.prototype.applyLocks = function(data) {
+  var objects = {};
+  goog.object.forEach(data['locks'], function(user, id) {
+    objects[user] = objects[user] || [];
+    objects[user].push(id);
+  }, this);
+
+  goog.object.forEach(objects, function(ids, user) {
+    this.applyLock({
+      'user': user,
+      'objects': ids
+    });
+  }, this);
+};
+
+
 /**
  * Handles released locks for selection.
  *
@@ -1185,3 +1326,20 @@ shapy.editor.Executor.Type = {
   WRITE: 'write',
   READ: 'read'
 };
+
+
+/**
+ * List of message encodings, negotiated as WebSocket subprotocols.
+ * @enum {string}
+ */
+shapy.editor.Executor.Protocol = {
+  MSGPACK: 'shapy.msgpack',
+  JSON: 'shapy.json'
+};
+
+
+/**
+ * Tools which are not implemented by the server.
+ * @const {!Array<string>}
+ */
+shapy.editor.Executor.CLIENT_TOOLS = ['extrude', 'connect', 'merge', 'weld'];
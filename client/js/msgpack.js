@@ -0,0 +1,323 @@
+// This file is part of the Shapy project.
+// Licensing information can be found in the LICENSE file.
+// (C) 2015 The Shapy Team. All rights reserved.
+goog.provide('shapy.msgpack');
+
+goog.require('goog.array');
+goog.require('goog.object');
+
+
+
+/**
+ * Serializes a JSON-like value in the MessagePack format.
+ *
+ * Keys with undefined values are skipped, just like JSON.stringify does.
+ *
+ * @param {*} value Value to encode.
+ *
+ * @return {!Uint8Array} Encoded bytes.
+ */
+shapy.msgpack.encode = function(value) {
+  var bytes = [];
+  shapy.msgpack.write_(value, bytes);
+  return new Uint8Array(bytes);
+};
+
+
+/**
+ * Deserializes a MessagePack encoded value.
+ *
+ * @param {!Uint8Array} bytes Encoded bytes.
+ *
+ * @return {*} Decoded value.
+ */
+shapy.msgpack.decode = function(bytes) {
+  var reader = {
+    view: new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength),
+    bytes: bytes,
+    pos: 0
+  };
+  return shapy.msgpack.read_(reader);
+};
+
+
+/**
+ * Appends an unsigned big-endian integer to the output.
+ *
+ * @private
+ *
+ * @param {!Array<number>} bytes Output buffer.
+ * @param {number}         value Value to write.
+ * @param {number}         size  Number of bytes.
+ */
+shapy.msgpack.writeUint_ = function(bytes, value, size) {
+  for (var i = size - 1; i >= 0; --i) {
+    bytes.push(Math.floor(value / Math.pow(2, i * 8)) & 0xff);
+  }
+};
+
+
+/**
+ * Appends the header of a string, array or map to the output.
+ *
+ * @private
+ *
+ * @param {!Array<number>} bytes  Output buffer.
+ * @param {number}         length Number of items.
+ * @param {number}         fix    Tag of the fixed format.
+ * @param {number}         fixMax Length limit of the fixed format, exclusive.
+ * @param {!Array<number>} tags   Tags of the 8, 16 and 32 bit formats, 0 if
+ *                                there is no 8 bit format.
+ */
+shapy.msgpack.writeHeader_ = function(bytes, length, fix, fixMax, tags) {
+  if (length < fixMax) {
+    bytes.push(fix | length);
+  } else if (tags[0] && length < 0x100) {
+    bytes.push(tags[0]);
+    shapy.msgpack.writeUint_(bytes, length, 1);
+  } else if (length < 0x10000) {
+    bytes.push(tags[1]);
+    shapy.msgpack.writeUint_(bytes, length, 2);
+  } else {
+    bytes.push(tags[2]);
+    shapy.msgpack.writeUint_(bytes, length, 4);
+  }
+};
+
+
+/**
+ * Appends an encoded value to the output.
+ *
+ * @private
+ *
+ * @param {*}              value Value to encode.
+ * @param {!Array<number>} bytes Output buffer.
+ */
+shapy.msgpack.write_ = function(value, bytes) {
+  if (value === null || !goog.isDef(value)) {
+    bytes.push(0xc0);
+    return;
+  }
+
+  if (goog.isBoolean(value)) {
+    bytes.push(value ? 0xc3 : 0xc2);
+    return;
+  }
+
+  if (goog.isNumber(value)) {
+    if (value % 1 == 0 && value >= 0 && value < 0x100000000) {
+      if (value < 0x80) {
+        bytes.push(value);
+      } else if (value < 0x100) {
+        bytes.push(0xcc, value);
+      } else if (value < 0x10000) {
+        bytes.push(0xcd);
+        shapy.msgpack.writeUint_(bytes, value, 2);
+      } else {
+        bytes.push(0xce);
+        shapy.msgpack.writeUint_(bytes, value, 4);
+      }
+    } else if (value % 1 == 0 && value < 0 && value >= -0x80000000) {
+      if (value >= -0x20) {
+        bytes.push(value & 0xff);
+      } else if (value >= -0x80) {
+        bytes.push(0xd0, value & 0xff);
+      } else if (value >= -0x8000) {
+        bytes.push(0xd1);
+        shapy.msgpack.writeUint_(bytes, value & 0xffff, 2);
+      } else {
+        bytes.push(0xd2);
+        shapy.msgpack.writeUint_(bytes, value >>> 0, 4);
+      }
+    } else {
+      var buffer = new DataView(new ArrayBuffer(8));
+      buffer.setFloat64(0, value);
+      bytes.push(0xcb);
+      for (var i = 0; i < 8; ++i) {
+        bytes.push(buffer.getUint8(i));
+      }
+    }
+    return;
+  }
+
+  if (goog.isString(value)) {
+    var utf8 = unescape(encodeURIComponent(value));
+    shapy.msgpack.writeHeader_(
+        bytes, utf8.length, 0xa0, 0x20, [0xd9, 0xda, 0xdb]);
+    for (var i = 0; i < utf8.length; ++i) {
+      bytes.push(utf8.charCodeAt(i));
+    }
+    return;
+  }
+
+  if (goog.isArray(value)) {
+    shapy.msgpack.writeHeader_(
+        bytes, value.length, 0x90, 0x10, [0, 0xdc, 0xdd]);
+    goog.array.forEach(value, function(item) {
+      shapy.msgpack.write_(item, bytes);
+    });
+    return;
+  }
+
+  var keys = goog.array.filter(goog.object.getKeys(value), function(key) {
+    return goog.isDef(value[key]) && !goog.isFunction(value[key]);
+  });
+  shapy.msgpack.writeHeader_(bytes, keys.length, 0x80, 0x10, [0, 0xde, 0xdf]);
+  goog.array.forEach(keys, function(key) {
+    shapy.msgpack.write_(key, bytes);
+    shapy.msgpack.write_(value[key], bytes);
+  });
+};
+
+
+/**
+ * Reads a value from the input.
+ *
+ * @private
+ *
+ * @param {!Object} reader Input buffer and position.
+ *
+ * @return {*} Decoded value.
+ */
+shapy.msgpack.read_ = function(reader) {
+  var view = reader.view;
+  var tag = view.getUint8(reader.pos++);
+  var value;
+
+  // Fixed formats.
+  if (tag < 0x80) {
+    return tag;
+  }
+  if (tag >= 0xe0) {
+    return tag - 0x100;
+  }
+  if ((tag & 0xf0) == 0x80) {
+    return shapy.msgpack.readMap_(reader, tag & 0x0f);
+  }
+  if ((tag & 0xf0) == 0x90) {
+    return shapy.msgpack.readArray_(reader, tag & 0x0f);
+  }
+  if ((tag & 0xe0) == 0xa0) {
+    return shapy.msgpack.readString_(reader, tag & 0x1f);
+  }
+
+  switch (tag) {
+    case 0xc0: return null;
+    case 0xc2: return false;
+    case 0xc3: return true;
+    case 0xc4: case 0xc5: case 0xc6: {
+      var length = shapy.msgpack.readUint_(reader, 1 << (tag - 0xc4));
+      value = reader.bytes.subarray(reader.pos, reader.pos + length);
+      reader.pos += length;
+      return value;
+    }
+    case 0xca: value = view.getFloat32(reader.pos); reader.pos += 4; break;
+    case 0xcb: value = view.getFloat64(reader.pos); reader.pos += 8; break;
+    case 0xcc: return shapy.msgpack.readUint_(reader, 1);
+    case 0xcd: return shapy.msgpack.readUint_(reader, 2);
+    case 0xce: return shapy.msgpack.readUint_(reader, 4);
+    case 0xcf: return shapy.msgpack.readUint_(reader, 8);
+    case 0xd0: value = view.getInt8(reader.pos); reader.pos += 1; break;
+    case 0xd1: value = view.getInt16(reader.pos); reader.pos += 2; break;
+    case 0xd2: value = view.getInt32(reader.pos); reader.pos += 4; break;
+    case 0xd3: {
+      value = view.getInt32(reader.pos) * 0x100000000 +
+              view.getUint32(reader.pos + 4);
+      reader.pos += 8;
+      break;
+    }
+    case 0xd9: case 0xda: case 0xdb: {
+      return shapy.msgpack.readString_(
+          reader, shapy.msgpack.readUint_(reader, 1 << (tag - 0xd9)));
+    }
+    case 0xdc: case 0xdd: {
+      return shapy.msgpack.readArray_(
+          reader, shapy.msgpack.readUint_(reader, tag == 0xdc ? 2 : 4));
+    }
+    case 0xde: case 0xdf: {
+      return shapy.msgpack.readMap_(
+          reader, shapy.msgpack.readUint_(reader, tag == 0xde ? 2 : 4));
+    }
+    default: {
+      throw new Error('Unsupported MessagePack type ' + tag);
+    }
+  }
+  return value;
+};
+
+
+/**
+ * Reads an unsigned big-endian integer.
+ *
+ * @private
+ *
+ * @param {!Object} reader Input buffer and position.
+ * @param {number}  size   Number of bytes.
+ *
+ * @return {number}
+ */
+shapy.msgpack.readUint_ = function(reader, size) {
+  var value = 0;
+  for (var i = 0; i < size; ++i) {
+    value = value * 0x100 + reader.bytes[reader.pos++];
+  }
+  return value;
+};
+
+
+/**
+ * Reads an UTF-8 string.
+ *
+ * @private
+ *
+ * @param {!Object} reader Input buffer and position.
+ * @param {number}  length Length in bytes.
+ *
+ * @return {string}
+ */
+shapy.msgpack.readString_ = function(reader, length) {
+  var chars = [];
+  for (var i = 0; i < length; ++i) {
+    chars.push(String.fromCharCode(reader.bytes[reader.pos++]));
+  }
+  return decodeURIComponent(escape(chars.join('')));
+};
+
+
+/**
+ * Reads an array.
+ *
+ * @private
+ *
+ * @param {!Object} reader Input buffer and position.
+ * @param {number}  length Number of items.
+ *
+ * @return {!Array<*>}
+ */
+shapy.msgpack.readArray_ = function(reader, length) {
+  var array = [];
+  for (var i = 0; i < length; ++i) {
+    array.push(shapy.msgpack.read_(reader));
+  }
+  return array;
+};
+
+
+/**
+ * Reads a map.
+ *
+ * @private
+ *
+ * @param {!Object} reader Input buffer and position.
+ * @param {number}  length Number of entries.
+ *
+ * @return {!Object}
+ */
+shapy.msgpack.readMap_ = function(reader, length) {
+  var map = {};
+  for (var i = 0; i < length; ++i) {
+    var key = shapy.msgpack.read_(reader);
+    map[key] = shapy.msgpack.read_(reader);
+  }
+  return map;
+};
@@ -0,0 +1,124 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import json
+import time
+
+import momoko
+from tornado.gen import Return, coroutine
+
+
+# Access levels of a user to an asset.
+NONE = 0
+READ = 1
+WRITE = 2
+OWNER = 3
+
+
+
+class ACL(object):
+  """Cache of the access levels of users to assets.
+
+  Levels are resolved from the assets & permissions tables and kept for a
+  short while. Whenever permissions change, the entries of the asset are
+  dropped by all processes through a redis channel.
+  """
+
+  # Channel used to announce changed permissions.
+  CHANNEL = 'acl'
+
+  # Number of seconds an access level is cached for.
+  TTL = 30
+
+  # Maximum number of cached access levels.
+  MAX_SIZE = 10000
+
+  def __init__(self, db, redis, hub):
+    """Creates an empty cache, listening for invalidations."""
+
+    self.db = db
+    self.redis = redis
+    self.cache = {}
+    self.size = 0
+    hub.subscribe(self.CHANNEL, self)
+
+  @coroutine
+  def resolve(self, asset_id, user):
+    """Returns the type of an asset & the access level of a user to it.
+
+    The type is None if the asset does not exist.
+    """
+
+    asset_id = int(asset_id)
+    user_id = user.id if user else None
+    now = time.time()
+
+    entry = self.cache.get(asset_id, {}).get(user_id)
+    if entry is not None and entry[0] > now:
+      raise Return(entry[1])
+
+    cursor = yield momoko.Op(self.db.execute,
+      '''SELECT assets.type, assets.public, assets.owner, permissions.write
+         FROM assets
+         LEFT OUTER JOIN permissions
+         ON permissions.asset_id = assets.id
+           AND permissions.user_id = %(user)s
+         WHERE assets.id = %(id)s
+      ''', {
+        'id': asset_id,
+        'user': user_id
+    })
+
+    data = cursor.fetchone()
+    if not data:
+      access = (None, NONE)
+    elif user_id is not None and data['owner'] == user_id:
+      access = (data['type'], OWNER)
+    elif user_id is not None and data['write'] is not None:
+      access = (data['type'], WRITE if data['write'] else READ)
+    elif data['public']:
+      access = (data['type'], READ)
+    else:
+      access = (data['type'], NONE)
+
+    self.store_(asset_id, user_id, access, now)
+    raise Return(access)
+
+  def store_(self, asset_id, user_id, access, now):
+    """Caches an access level, evicting old entries if full."""
+
+    if self.size >= self.MAX_SIZE:
+      for id, users in self.cache.items():
+        for user, entry in users.items():
+          if entry[0] <= now:
+            del users[user]
+            self.size -= 1
+        if not users:
+          del self.cache[id]
+      if self.size >= self.MAX_SIZE:
+        self.cache = {}
+        self.size = 0
+
+    users = self.cache.setdefault(asset_id, {})
+    if user_id not in users:
+      self.size += 1
+    users[user_id] = (now + self.TTL, access)
+
+  def invalidate(self, asset_id):
+    """Drops the access levels to an asset in all processes."""
+
+    self.drop_(int(asset_id))
+    return self.redis.publish(self.CHANNEL, json.dumps({
+      'asset': int(asset_id)
+    }))
+
+  def drop_(self, asset_id):
+    """Drops the cached access levels to an asset."""
+
+    self.size -= len(self.cache.pop(asset_id, {}))
+
+  def on_channel(self, packet):
+    """Handles an invalidation from another process."""
+
+    self.drop_(packet.data['asset'])
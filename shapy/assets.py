@@ -2,24 +2,38 @@
 # Licensing information can be found in the LICENSE file.
 # (C) 2015 The Shapy Team. All rights reserved.
 
+import datetime
+import email.utils
 import hashlib
 import json
+import tempfile
 
 import momoko
 import psycopg2
 from tornado.gen import Return, coroutine
-from tornado.web import HTTPError, asynchronous
-
-from PIL import Image
-import re
-import cStringIO
-import base64
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.web import HTTPError, asynchronous, stream_request_body
 
+from shapy import acl, images
 from shapy.account import Account
 from shapy.common import APIHandler, BaseHandler, session
+from shapy.live import LiveScene
+from shapy.mesh import import_mesh
+from shapy.oplog import OpLog
+from shapy.render import update_preview
 from shapy.scene import Scene
 
 
+# Content types of the cached export formats of scenes.
+EXPORT_TYPES = {
+  'obj': 'text/plain',
+  'stl': 'text/plain',
+  'stlb': 'application/octet-stream',
+  'buffers': 'application/octet-stream'
+}
+
+
 def is_owner(user, asset):
   """Checks if a user owns an asset."""
 
@@ -159,55 +173,54 @@ class AssetHandler(APIHandler):
   TYPE = None
   NEW_NAME = None
 
-  def _generate_preview(self, data):
-    """Generates a preview image."""
-    return None
+  @coroutine
+  def _encode(self, data, preview):
+    """Converts uploaded data into its stored form, along with a preview."""
+    raise Return((data, preview))
+
 
+  @coroutine
+  def _access(self, id, user):
+    """Checks that a user can read an asset, returning the access level."""
+
+    # Check permissions, usually without querying the database.
+    type, access = yield self.acl.resolve(id, user)
+    if type != self.TYPE:
+      raise HTTPError(404, 'Asset not found')
+    if access == acl.NONE:
+      raise HTTPError(400, 'Asset not found')
+    raise Return(access)
 
   @coroutine
   def _fetch(self, id, user):
     """Retrieves an asset from the database."""
 
-    # Fetch data from the asset and permission table.
-    # The write flag will have 3 possible values: None, True, False
+    access = yield self._access(id, user)
     cursor = yield momoko.Op(self.db.execute,
-      '''SELECT id, name, preview::bytea, data::bytea, public, owner, write
+      '''SELECT id, name, preview::bytea, data::bytea, public, owner
          FROM assets
-         LEFT OUTER JOIN permissions
-         ON permissions.asset_id = assets.id
-         WHERE assets.id = %(id)s
-           AND assets.type = %(type)s
-           AND (permissions.user_id = %(user)s OR
-                permissions.user_id is NULL OR
-                %(user)s IS NULL)
+         WHERE id = %(id)s
       ''', {
-        'id': id,
-        'user': user.id if user else None,
-        'type': self.TYPE
+        'id': id
     })
 
     data = cursor.fetchone()
     if not data:
       raise HTTPError(404, 'Asset not found')
 
-    if user and data['owner'] == user.id:
-      # Owner - full permissions.
-      owner = True
-      write = True
-    elif data['write'] is None:
-      if not data['public']:
-        # No permissions.
-        raise HTTPError(400, 'Asset not found')
-      else:
-        # Public asset - read only.
-        owner = False
-        write = False
-    else:
-      # Shared asset - permission in table.
-      owner = False
-      write = user is not None and data['write']
+    raise Return((data, access == acl.OWNER, access >= acl.WRITE))
 
-    raise Return((data, owner, write))
+  @coroutine
+  def _stream(self, chunks):
+    """Writes the chunks of a large response, flushing each one.
+
+    Waiting for the flush yields to the IOLoop between chunks and keeps slow
+    clients from buffering the whole file in memory.
+    """
+
+    for chunk in chunks:
+      self.write(chunk)
+      yield self.flush()
 
 
   @session
@@ -227,7 +240,7 @@ class AssetHandler(APIHandler):
         'id': data['id'],
         'name': data['name'],
         'preview': str(data['preview'] or ''),
-        'data': str(data['data'] or '') if self.TYPE == 'texture'
+        'data': self._data_url(data) if self.TYPE == 'texture'
                 else json.loads(str(data['data'] or 'null')),
         'public': data['public'],
         'owner': owner,
@@ -250,8 +263,25 @@ class AssetHandler(APIHandler):
     preview = self.get_argument('preview', None)
     mainData = self.get_argument('data', None)
     name = self.get_argument('name', None)
-    if preview is None and mainData is not None:
-      preview = self._generate_preview(mainData)
+    if mainData is not None:
+      mainData, preview = yield self._encode(mainData, preview)
+
+    id = yield self._create(user, parent, name, mainData, preview)
+
+    # Previews of scenes are rendered by the server.
+    if mainData is not None and self.TYPE == 'scene':
+      IOLoop.current().spawn_callback(
+          update_preview, self.application, id, mainData)
+
+    # Downscaled levels of textures are built in the background.
+    if mainData is not None and self.TYPE == 'texture':
+      IOLoop.current().spawn_callback(
+          images.update_levels, self.application, id, mainData)
+    self.finish()
+
+  @coroutine
+  def _create(self, user, parent, name, mainData, preview):
+    """Stores a new asset in a directory of a user, returning its ID."""
 
     # Reject parent dirs not owned by user
     if parent != 0:
@@ -308,7 +338,7 @@ class AssetHandler(APIHandler):
         'preview': preview,
         'data': []
     })
-    self.finish()
+    raise Return(data[0])
 
 
   @session
@@ -345,6 +375,11 @@ class AssetHandler(APIHandler):
     if not data:
       raise HTTPError(400, 'Asset deletion failed')
 
+    if self.TYPE == 'scene':
+      self.exports.drop(id)
+    if self.TYPE == 'texture':
+      self.textures.drop(id)
+    yield self.acl.invalidate(id)
     self.finish()
 
   @session
@@ -404,30 +439,14 @@ class AssetHandler(APIHandler):
 
     else:
       # Check if user has write permission
-      cursor = yield momoko.Op(self.db.execute,
-        '''SELECT 1
-           FROM assets
-           LEFT OUTER JOIN permissions
-           ON permissions.asset_id = assets.id
-           WHERE assets.id = %(id)s
-             AND assets.type = %(type)s
-             AND ((permissions.user_id = %(user)s AND
-                   permissions.write IS TRUE AND
-                   %(public)s IS NULL) OR
-                  (assets.owner = %(user)s))
-        ''', {
-        'id': id,
-        'type': self.TYPE,
-        'user': user.id,
-        'public': public
-      })
-
-      if not cursor.fetchone():
+      type, access = yield self.acl.resolve(id, user)
+      writeable = access == acl.WRITE and public is None
+      if type != self.TYPE or not (access == acl.OWNER or writeable):
         raise HTTPError(400, 'Asset cannot be edited')
 
-    # Try generating a preview.
-    if preview is None and data is not None:
-      preview = self._generate_preview(data)
+    # Convert the data, trying to generate a preview.
+    if data is not None:
+      data, preview = yield self._encode(data, preview)
 
     # Update
     cursor = yield momoko.Op(self.db.execute,
@@ -443,7 +462,7 @@ class AssetHandler(APIHandler):
       ''', {
       'id': id,
       'name': name,
-      'data': psycopg2.Binary(data.encode('ascii')) if data else None,
+      'data': psycopg2.Binary(str(data)) if data else None,
       'public': public,
       'preview': psycopg2.Binary(str(preview)) if preview else None,
       'parent': parent
@@ -452,6 +471,20 @@ class AssetHandler(APIHandler):
     if not cursor.fetchone():
       raise HTTPErorr(400, 'Asset update failed.')
 
+    # Exports of the old data are not needed anymore.
+    if data is not None and self.TYPE == 'scene':
+      self.exports.drop(id)
+
+    # Downscaled levels of textures are built in the background.
+    if data is not None and self.TYPE == 'texture':
+      self.textures.drop(id)
+      IOLoop.current().spawn_callback(
+          images.update_levels, self.application, id, data)
+
+    # Public assets can be read by everyone.
+    if public is not None:
+      yield self.acl.invalidate(id)
+
     self.finish()
 
 
@@ -539,59 +572,281 @@ class TextureHandler(AssetHandler):
   TYPE = 'texture'
   NEW_NAME = 'New Texture'
 
-  def _generate_preview(self, data):
-    """Generates a preview image."""
-    b64data = re.sub('^data:image/.+;base64,', '', str(data))
+  def _data_url(self, data):
+    """Returns the URL the image of a texture is served from."""
+
+    if not data['data']:
+      return ''
+    return '/api/assets/texture?id=%d&format=native' % data['id']
+
+  @coroutine
+  def _encode(self, data, preview):
+    """Stores the raw bytes of an image, generating a preview if missing."""
 
-    im = Image.open(cStringIO.StringIO(b64data.decode('base64')))
-    im = im.convert('RGB')
-    im.thumbnail((150, 150), Image.ANTIALIAS)
+    try:
+      data, thumbnail = yield self.offload(images.store, data)
+    except (IOError, ValueError):
+      raise HTTPError(400, 'Invalid image')
+    raise Return((data, preview or thumbnail))
 
-    stream = cStringIO.StringIO()
-    im.save(stream, format='JPEG')
-    return 'data:image/jpeg;base64,%s' % base64.b64encode(stream.getvalue())
+  @coroutine
+  def _fetch(self, id, user):
+    """Retrieves a texture with only the first bytes of its image.
+
+    JSON responses link to the image, so they only need to know if there is
+    one. The image is loaded & converted when it is served.
+    """
+
+    access = yield self._access(id, user)
+    cursor = yield momoko.Op(self.db.execute,
+      '''SELECT id, name, preview::bytea,
+                substring(data from 1 for %(length)s) AS data, public, owner
+         FROM assets
+         WHERE id = %(id)s
+      ''', {
+        'id': id,
+        'length': len(images.MAGIC)
+    })
+
+    data = cursor.fetchone()
+    if not data:
+      raise HTTPError(404, 'Asset not found')
+
+    raise Return((data, access == acl.OWNER, access >= acl.WRITE))
+
+  @coroutine
+  def _load(self, id, user):
+    """Retrieves a texture, converting it to raw bytes if it is a data URL."""
+
+    data, owner, write = yield super(TextureHandler, self)._fetch(id, user)
+    if data['data'] and not images.is_packed(data['data']):
+      try:
+        data['data'] = yield self.offload(images.pack, str(data['data']))
+      except (IOError, ValueError):
+        app_log.warning('Cannot convert texture %s', data['id'])
+        raise Return((data, owner, write))
+
+      # Textures are only stored as data URLs if they were not saved since.
+      yield momoko.Op(self.db.execute,
+        '''UPDATE assets
+           SET data = %(data)s
+           WHERE id = %(id)s
+             AND substring(data from 1 for 5) = %(prefix)s
+        ''', {
+        'id': data['id'],
+        'data': psycopg2.Binary(data['data']),
+        'prefix': psycopg2.Binary('data:')
+      })
+      IOLoop.current().spawn_callback(
+          images.update_levels, self.application, data['id'], data['data'])
+
+    raise Return((data, owner, write))
+
+  @coroutine
+  def _locate(self, id, user, size):
+    """Finds the smallest level of a texture covering a box of some size.
+
+    The whole image is picked if size is None. Returns the first bytes of the
+    texture, holding its header, & the MIME type, width, height, offset &
+    length of the level.
+    """
+
+    yield self._access(id, user)
+    cursor = yield momoko.Op(self.db.execute,
+      '''SELECT substring(data from 1 for %(length)s), length(data)
+         FROM assets
+         WHERE id = %(id)s
+      ''', {
+        'id': id,
+        'length': images.MAX_HEADER
+    })
+    row = cursor.fetchone()
+    if not row:
+      raise HTTPError(404, 'Asset not found')
+    if not row[0]:
+      raise HTTPError(404, 'Texture has no image')
+
+    # Textures still stored as data URLs are converted first.
+    header, length = row
+    if not images.is_packed(header):
+      data, _, _ = yield self._load(id, user)
+      if not images.is_packed(data['data']):
+        raise HTTPError(400, 'Invalid image')
+      header, length = data['data'][:images.MAX_HEADER], len(data['data'])
+
+    level = images.select(images.read_header(header, length), size)
+    raise Return((header, level))
+
+  @coroutine
+  def _read(self, id, user, size, header, level, digest=False):
+    """Reads the bytes of a level of a texture, or only their MD5 digest.
+
+    Only the level is loaded, or nothing but its digest, as long as the header
+    did not change. Otherwise the texture is read whole & the level picked
+    anew. Returns the level & its bytes or digest.
+    """
+
+    value = 'substring(data from %(offset)s for %(length)s)'
+    if digest:
+      value = 'md5(%s)' % value
+    cursor = yield momoko.Op(self.db.execute,
+      '''SELECT ''' + value + '''
+         FROM assets
+         WHERE id = %(id)s
+           AND substring(data from 1 for %(size)s) = %(header)s
+      ''', {
+        'id': id,
+        'offset': level[3] + 1,
+        'length': level[4],
+        'size': len(header),
+        'header': psycopg2.Binary(str(header))
+    })
+    row = cursor.fetchone()
+    if row:
+      raise Return((level, row[0]))
+
+    # The texture was replaced, such as when its levels were added.
+    data, _, _ = yield self._load(id, user)
+    if not data['data'] or not images.is_packed(data['data']):
+      raise HTTPError(404, 'Texture has no image')
+    level = images.select(
+        images.read_header(data['data'], len(data['data'])), size)
+    image = buffer(data['data'], level[3], level[4])
+    raise Return((level, hashlib.md5(image).hexdigest() if digest else image))
 
   @session
   @coroutine
   @asynchronous
   def get(self, user):
-    """Fetches a scene either as JSON or some other format."""
+    """Fetches a texture either as JSON or as an image."""
 
-    # If format is unspecified, dump as JSON.
+    # If neither format nor size are specified, dump as JSON.
     fmt = self.get_argument('format', None)
-    if not fmt or fmt == 'json':
+    size = self.get_argument('size', None)
+    if (not fmt or fmt == 'json') and size is None:
       yield super(TextureHandler, self).get()
       return
-
-    # Decode image.
-    data, _, _ = yield self._fetch(self.get_argument('id'), user)
-    image = Image.open(cStringIO.StringIO(re.sub(
-        '^data:image/.+;base64,', '', data['data']).decode('base64')))
-    stream = cStringIO.StringIO()
-
-    if fmt == 'png':
-      self.set_header('Content-Type', 'image/png')
-      image.save(stream, 'png')
-    elif fmt == 'jpeg':
-      self.set_header('Content-Type', 'image/jpeg')
-      image.save(stream, 'jpeg')
-    else:
+    fmt = fmt or 'native'
+    if fmt not in ('native', 'png', 'jpeg'):
       raise HTTPError(400, 'Unsupported image format')
+    if size is not None:
+      try:
+        size = int(size)
+      except ValueError:
+        raise HTTPError(400, 'Invalid size')
+
+    # Stored bytes are sent as they are if no conversion is needed.
+    id = self.get_argument('id')
+    header, level = yield self._locate(id, user, size)
+    if fmt == 'native' or level[0] == 'image/%s' % fmt:
+      level, image = yield self._read(id, user, size, header, level)
+      self.set_header('Content-Type', level[0])
+      self.set_header('Content-Length', str(len(image)))
+      yield self._stream(
+          image[i:i + images.CHUNK_SIZE]
+          for i in xrange(0, len(image), images.CHUNK_SIZE))
+      self.finish()
+      return
+
+    # Converted images are cached by the digest of their source, which the
+    # database computes without sending the source.
+    level, digest = yield self._read(id, user, size, header, level, True)
+    key = self.textures.key(id, digest, max(level[1:3]), fmt)
+    self.set_header('Content-Type', 'image/%s' % fmt)
+    self.set_header('Cache-Control', 'no-cache')
+    self.set_header('Etag', '"%s"' % key)
+    if self.check_etag_header():
+      self.set_status(304)
+      self.finish()
+      return
+
+    cached = self.textures.get(key)
+    if cached is None:
+      level, image = yield self._read(id, user, size, header, level)
+      try:
+        data = yield self.offload(images.convert, str(image), fmt)
+      except (IOError, ValueError):
+        raise HTTPError(400, 'Invalid image')
+      key = self.textures.key(
+          id, hashlib.md5(image).hexdigest(), max(level[1:3]), fmt)
+      self.set_header('Etag', '"%s"' % key)
+      cached = self.textures.put(key, data)
+
+    data, modified = cached
+    modified = datetime.datetime.utcfromtimestamp(int(modified))
+    self.set_header('Last-Modified', modified)
+    since = self.request.headers.get('If-Modified-Since')
+    if since and 'If-None-Match' not in self.request.headers:
+      since = email.utils.parsedate(since)
+      if since and datetime.datetime(*since[:6]) >= modified:
+        self.set_status(304)
+        self.finish()
+        return
 
-    data = stream.getvalue()
     self.set_header('Content-Length', str(len(data)))
     self.write(data)
     self.finish()
 
 
-
-
+@stream_request_body
 class SceneHandler(AssetHandler):
-  """Handles requests to a texture asset."""
+  """Handles requests to a scene asset.
+
+  Bodies are streamed so that imported meshes are spooled to disk instead of
+  being held in memory. Other bodies are buffered & parsed as usual.
+  """
 
   TYPE = 'scene'
   NEW_NAME = 'New Scene'
 
+  @coroutine
+  def prepare(self):
+    """Opens a file for imported meshes.
+
+    Imports are spooled to disk before they are handled, so anonymous ones
+    are rejected before the body is read.
+    """
+
+    self.body = []
+    self.upload = None
+    if self.request.method == 'POST' and self.get_query_argument('format', ''):
+      token = self.get_secure_cookie('session')
+      user = None
+      if token:
+        user = yield self.application.sessions.get(token)
+      if not user:
+        raise HTTPError(401, 'User not logged in')
+      self.request.connection.set_max_body_size(self.application.IMPORT_SIZE)
+      self.upload = tempfile.NamedTemporaryFile(prefix='shapy-import-')
+
+  def data_received(self, chunk):
+    """Writes a chunk of the body to the upload or buffers it."""
+
+    if self.upload is not None:
+      self.upload.write(chunk)
+    else:
+      self.body.append(chunk)
+
+  def parse_body_(self):
+    """Parses the arguments of a buffered body."""
+
+    self.request.body = ''.join(self.body)
+    self.request._parse_body()
+    super(SceneHandler, self).prepare()
+
+  def on_finish(self):
+    """Removes the uploaded mesh."""
+
+    if self.upload is not None:
+      self.upload.close()
+    super(SceneHandler, self).on_finish()
+
+  def on_connection_close(self):
+    """Removes the uploaded mesh if the client went away."""
+
+    if self.upload is not None:
+      self.upload.close()
+
   @session
   @coroutine
   @asynchronous
@@ -603,20 +858,176 @@ class SceneHandler(AssetHandler):
       yield super(SceneHandler, self).get()
       return
 
-    data, _, _ = yield self._fetch(self.get_argument('id'), user)
-    scene = Scene(data['name'], json.loads(str(data['data'] or 'null')))
+    id = self.get_argument('id')
+    if fmt == 'glb':
+      data, _, _ = yield self._fetch(id, user)
+      scene = Scene(data['name'], json.loads(str(data['data'] or 'null')))
+      textures = yield self._fetch_textures(scene, user)
+      self.set_header('Content-Type', 'model/gltf-binary')
+      self.write(scene.to_glb(textures))
+      self.finish()
+      return
+    if fmt not in EXPORT_TYPES:
+      raise HTTPError(400, 'Format not supported')
 
-    if fmt == 'obj':
-      self.set_header('Content-Type', 'text/plain')
-      self.write(scene.to_obj())
-    elif fmt == 'stl':
-      self.set_header('Content-Type', 'text/plain')
-      self.write(scene.to_stl())
+    # Exports of the same data are identical, so they are cached by the digest
+    # of the data, which the database computes without sending the data.
+    yield self._access(id, user)
+    cursor = yield momoko.Op(self.db.execute,
+      '''SELECT md5(COALESCE(data, ''::bytea))
+         FROM assets
+         WHERE id = %(id)s
+      ''', {
+        'id': id
+    })
+    row = cursor.fetchone()
+    if not row:
+      raise HTTPError(404, 'Asset not found')
+
+    key = self.exports.key(id, row[0], fmt)
+    self.set_header('Content-Type', EXPORT_TYPES[fmt])
+    self.set_header('Etag', '"%s"' % key)
+    if self.check_etag_header():
+      self.set_status(304)
+      self.finish()
+      return
+
+    cached = self.exports.get(key)
+    if cached:
+      size, chunks = cached
+      self.set_header('Content-Length', str(size))
     else:
+      # The scene might have been saved since its digest was computed.
+      data, _, _ = yield self._fetch(id, user)
+      key = self.exports.key(
+          id, hashlib.md5(str(data['data'] or '')).hexdigest(), fmt)
+      self.set_header('Etag', '"%s"' % key)
+      scene = Scene(data['name'], json.loads(str(data['data'] or 'null')))
+      if fmt == 'obj':
+        chunks = scene.iter_obj()
+      elif fmt == 'stl':
+        chunks = scene.iter_stl()
+      elif fmt == 'stlb':
+        chunks = scene.iter_stlb()
+      else:
+        chunks = [scene.to_buffers()]
+      chunks = self.exports.put(key, chunks)
+
+    yield self._stream(chunks)
+    self.finish()
+
+  @session
+  @coroutine
+  @asynchronous
+  def delete(self, user):
+    """Deletes a scene."""
+
+    self.parse_body_()
+    yield super(SceneHandler, self).delete()
+
+  @coroutine
+  def _encode(self, data, preview):
+    """Stores scenes as UTF-8, since names are not escaped by clients."""
+
+    raise Return((data.encode('utf-8'), preview))
+
+  @coroutine
+  def _fetch_textures(self, scene, user):
+    """Retrieves the encoded images of the textures used by a scene.
+
+    Textures the user cannot read or which glTF does not support are skipped.
+    """
+
+    ids = set(
+      int(obj.texture) for obj in scene.objects.itervalues() if obj.texture
+    )
+    access = yield [self.acl.resolve(id, user) for id in ids]
+    ids = tuple(
+      id for id, (type, level) in zip(ids, access)
+      if type == 'texture' and level != acl.NONE
+    )
+    if not ids:
+      raise Return({})
+
+    cursor = yield momoko.Op(self.db.execute,
+      '''SELECT id, data::bytea
+         FROM assets
+         WHERE id IN %(ids)s
+      ''', {
+        'ids': ids
+    })
+
+    textures = {}
+    for id, data in cursor.fetchall():
+      if not data:
+        continue
+      try:
+        mime, _, _, image = images.unpack(data)
+      except ValueError:
+        continue
+      if mime in ('image/png', 'image/jpeg'):
+        textures[id] = (mime, str(image))
+    raise Return(textures)
+
+  @session
+  @coroutine
+  @asynchronous
+  def post(self, user):
+    """Creates a scene, importing it from a mesh if a format is given."""
+
+    if self.upload is None:
+      self.parse_body_()
+      yield super(SceneHandler, self).post()
+      return
+
+    # Validate arguments.
+    if not user:
+      raise HTTPError(401, 'User not logged in')
+    fmt = self.get_argument('format')
+    if fmt not in ('obj', 'stl', 'stlb'):
       raise HTTPError(400, 'Format not supported')
+    parent = int(self.get_argument('parent', 0))
+    name = self.get_argument('name', None)
 
+    # Parsing takes a while, so it runs in another process.
+    self.upload.flush()
+    try:
+      data = yield self.offload(
+          import_mesh, self.upload.name, fmt,
+          timeout=self.application.IMPORT_TIMEOUT)
+    except ValueError as e:
+      raise HTTPError(400, 'Invalid mesh: %s' % e)
+
+    id = yield self._create(user, parent, name, data, None)
+    IOLoop.current().spawn_callback(update_preview, self.application, id, data)
     self.finish()
 
+  @session
+  @coroutine
+  @asynchronous
+  def put(self, user):
+    """Updates a scene, compacting the operation log if data was saved."""
+
+    self.parse_body_()
+    yield super(SceneHandler, self).put()
+
+    # Previews are rendered by the server whenever the data changes.
+    id = int(self.get_argument('id'))
+    data = self.get_argument('data', None)
+    if data is not None:
+      IOLoop.current().spawn_callback(
+          update_preview, self.application, id, data)
+
+    # The stored data is the new snapshot of the scene.
+    seq = self.get_argument('seq', None)
+    if seq is not None and data is not None:
+      oplog = OpLog(self.redis, id)
+      yield oplog.snapshot(int(seq))
+
+    # The server's copies must not overwrite the upload with older data.
+    if data is not None:
+      yield LiveScene.reload(self.redis, id)
+
 
 class TextureFilterHandler(APIHandler):
   """Handles a request to multiple textures."""
@@ -5,12 +5,14 @@
 import os
 import functools
 import json
+import time
 
 from tornado.web import RequestHandler, HTTPError
-from tornado.gen import Return, Task, coroutine
-import redis
+from tornado.gen import Return, Task, TimeoutError, coroutine
 
+from shapy import metrics
 from shapy.account import Account
+from shapy.pool import PoolFull
 
 
 def session(method):
@@ -25,24 +27,11 @@ def session(method):
       yield method(self, *args, user=None, **kwargs)
       raise Return()
 
-    # Map the session ID to a user & refresh expiration.
-    key = 'session:%s' % token
-    data = self.redis.get(key)
-    self.redis.expire(key, Account.SESSION_EXPIRE)
-
-    # If user not logged in, pass None.
-    if not data:
-      yield method(self, *args, user=None, **kwargs)
-      raise Return()
-
-    # Initialize the account object.
-    data = json.loads(data)
-    yield method(self, *args, user=Account(
-      data['id'],
-      first_name=data['first_name'],
-      last_name=data['last_name'],
-      email=data['email']
-    ), **kwargs)
+    # Map the session ID to a user, caching it in the process.
+    start = time.time()
+    user = yield self.application.sessions.get(token)
+    metrics.SESSIONS.observe(time.time() - start)
+    yield method(self, *args, user=user, **kwargs)
     raise Return()
 
   return wrapper
@@ -59,9 +48,36 @@ class BaseHandler(RequestHandler):
 
   @property
   def redis(self):
-    """Returns a reference to the redis connection."""
+    """Returns a reference to the redis connection pool."""
     return self.application.redis
 
+  @property
+  def acl(self):
+    """Returns a reference to the permission cache."""
+    return self.application.acl
+
+  @property
+  def exports(self):
+    """Returns a reference to the cache of exported scenes."""
+    return self.application.exports
+
+  @property
+  def textures(self):
+    """Returns a reference to the cache of converted textures."""
+    return self.application.textures
+
+  @coroutine
+  def offload(self, func, *args, **kwargs):
+    """Runs a CPU intensive job in the process pool, returning its result."""
+
+    try:
+      result = yield self.application.executor.run(func, *args, **kwargs)
+    except PoolFull:
+      raise HTTPError(503, 'Server busy')
+    except TimeoutError:
+      raise HTTPError(503, 'Job timed out')
+    raise Return(result)
+
   def on_finish(self):
     """Cleanup."""
 
@@ -72,12 +88,13 @@ class BaseHandler(RequestHandler):
   def login(self, user):
     """Logs the user in, storing a session entry in the database."""
     token = os.urandom(16).encode('hex')
-    self.redis.set('session:%s' % token, json.dumps({
-      'id': user[0],
-      'first_name': user[1],
-      'last_name': user[2],
-      'email': user[3]
-    }), Account.SESSION_EXPIRE)
+    yield self.redis.setex('session:%s' % token, Account.SESSION_EXPIRE,
+      json.dumps({
+        'id': user[0],
+        'first_name': user[1],
+        'last_name': user[2],
+        'email': user[3]
+      }))
     self.set_secure_cookie('session', token)
 
   def write_json(self, data):
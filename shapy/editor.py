@@ -2,17 +2,23 @@
 # Licensing information can be found in the LICENSE file.
 # (C) 2015 The Shapy Team. All rights reserved.
 
+import collections
 import json
 import momoko
 
 from threading import Timer
 from tornado.web import asynchronous
 from tornado.gen import engine, coroutine, Task, Return
+from tornado.log import app_log
 from tornado.web import HTTPError
 from tornado.websocket import WebSocketHandler
-import tornadoredis
 
+from shapy import acl, metrics, protocol
 from shapy.common import APIHandler, BaseHandler, session
+from shapy.live import LiveScene
+from shapy.locks import Locks
+from shapy.oplog import OpLog
+from shapy.outbox import Outbox
 
 
 class Scene(object):
@@ -38,78 +44,237 @@ class Scene(object):
 
 
 
+def count_sockets():
+  """Returns the number of clients & scenes, without naming the scenes."""
+
+  scenes = collections.Counter(
+      socket.scene_id for socket in WSHandler.sockets)
+  return [
+    ({ 'stat': 'clients' }, len(WSHandler.sockets)),
+    ({ 'stat': 'scenes' }, len(scenes)),
+    ({ 'stat': 'max' }, max(scenes.values() or [0]))
+  ]
+
+
+def count_queued():
+  """Returns the number of messages queued for slow clients."""
+
+  depths = [socket.outbox.depth for socket in WSHandler.sockets]
+  return [
+    ({ 'stat': 'total' }, sum(depths)),
+    ({ 'stat': 'max' }, max(depths or [0]))
+  ]
+
+
+def count_outbox():
+  """Returns the counters of the outboxes."""
+
+  return [
+    ({ 'event': 'coalesced' }, Outbox.coalesced),
+    ({ 'event': 'dropped' }, Outbox.dropped),
+    ({ 'event': 'resync' }, Outbox.resyncs)
+  ]
+
+
+metrics.Gauge(
+    'shapy_websockets', 'Clients & scenes being edited.', count_sockets)
+metrics.Gauge(
+    'shapy_outbox_depth', 'Messages queued for slow clients.', count_queued)
+metrics.Counter(
+    'shapy_outbox_total', 'Messages merged or dropped by outboxes.',
+    count_outbox)
+
+
+
 class WSHandler(WebSocketHandler, BaseHandler):
   """Handles websocket connections."""
 
+  # Clients connected to this process.
+  sockets = set()
+
+  def initialize(self):
+    """Sets up the state of the connection before it is opened."""
+
+    self.joined = False
+    self.inbox = collections.deque()
+    self.protocol = protocol.JSON
+
+    # Steps of joining a scene done so far, undone when the client leaves.
+    self.opening = True
+    self.closed = False
+    self.outbox = None
+    self.subscribed = False
+    self.added = False
+    self.live = None
+
+  def select_subprotocol(self, subprotocols):
+    """Picks the preferred message encoding requested by the client."""
+
+    for name in protocol.supported():
+      if name in subprotocols:
+        self.protocol = name
+        return name
+    return None
+
+  def get_compression_options(self):
+    """Enables permessage-deflate if the client supports it."""
+
+    return {}
+
+  def send(self, data):
+    """Sends a message to the client in the negotiated encoding."""
+
+    payload, binary = protocol.encode(self.protocol, data)
+    self.write_message(payload, binary=binary)
+
   @session
   @coroutine
   def open(self, scene_id, user):
-    """Handles an incoming connection."""
+    """Handles an incoming connection.
+
+    The client might go away while the scene is being joined, in which case
+    joining stops & whatever was done already is undone.
+    """
+
+    try:
+      yield self.join_(scene_id, user)
+    finally:
+      self.opening = False
+      if self.closed:
+        yield self.leave_()
+
+  @coroutine
+  def join_(self, scene_id, user):
+    """Joins a scene, returning early if the connection is closed."""
 
     # Read the scene ID & create a unique channel ID.
-    self.open = False
     self.user = user
     self.scene_id = scene_id
     self.writeable = yield self.is_writeable()
+    if self.closed:
+      return
     if self.writeable is None:
       self.close()
       return
 
     self.chan_id = 'chan_%s' % scene_id
     self.lock_id = 'lock_%s' % scene_id
+    self.users_id = 'users:%s' % scene_id
     self.objects = set()
+    self.locks = Locks(self.redis, scene_id)
+    self.oplog = OpLog(self.redis, scene_id)
+    self.outbox = Outbox(self)
+    self.pending = []
 
     # Start listening & broadcasting on the channel.
-    self.chan = tornadoredis.Client(
-        host=self.application.RD_HOST,
-        port=self.application.RD_PORT,
-        password=self.application.RD_PASS)
-    self.chan.connect()
-    yield Task(self.chan.subscribe, self.chan_id)
-    self.chan.listen(self.on_channel)
+    WSHandler.sockets.add(self)
+    self.subscribed = True
+    yield self.application.hub.subscribe(self.chan_id, self)
+    if self.closed:
+      return
 
     if self.writeable:
-      # Get the scene object & add the client.
-      def add_user(scene):
-        scene.add_user(self.user.id)
-      scene = yield self.update_scene_(add_user)
+      # Keep a copy of the scene up to date while it is being edited.
+      self.live = LiveScene.join(self.application, int(scene_id))
+
+      # Add the client. Users are kept in a set since other processes might
+      # be adding their own clients concurrently.
+      self.added = True
+      yield self.redis.sadd(self.users_id, self.user.id)
+      if self.closed:
+        return
 
       # Broadcast join message.
-      self.to_channel({
+      yield self.to_channel({
         'type': 'join',
         'user': self.user.id
       })
-    else:
-      scene = yield self.update_scene_(lambda x: x)
+      if self.closed:
+        return
+    scene = yield self.update_scene_(lambda x: x)
+    if self.closed:
+      return
 
     # Broadcast initial data.
-    self.write_message(json.dumps({
+    self.send({
         'type': 'meta',
         'name': scene.name,
         'users': scene.users
-    }))
-
-    # Get all the existing locks.
-    for key in self.redis.keys('scene:%s:*' % self.scene_id):
-      user = int(self.redis.get(key))
-      id = key.split(':')[-1]
-      if self.user and user == self.user.id:
-        self.objects.add(id)
-
-      self.write_message(json.dumps({
-        'type': 'lock',
-        'objects': [id],
-        'user': user
-      }))
-    self.open = True
+    })
+
+    # Replay the operations missing from the client's copy of the scene.
+    last = 0
+    since = self.get_argument('seq', None)
+    if since is not None:
+      last = int(since)
+      ops = yield self.oplog.since(last)
+      if self.closed:
+        return
+      if ops is None:
+        snapshot = yield self.oplog.snapshot_seq()
+        if self.closed:
+          return
+        self.send({
+          'type': 'resync',
+          'snapshot': snapshot
+        })
+      else:
+        self.send({ 'type': 'replay', 'ops': ops })
+        last = max([last] + [op['seq'] for op in ops])
+
+    # Send all the existing locks at once, after objects were replayed.
+    locks = yield self.locks.held()
+    if self.closed:
+      return
+    if self.user:
+      self.objects.update(
+          id for id, user in locks.iteritems() if user == self.user.id)
+    self.send({
+      'type': 'locks',
+      'locks': locks
+    })
+
+    # The server cannot write the scene until a client uploads it.
+    if self.writeable and self.live.stale:
+      self.send({ 'type': 'stale' })
+
+    # Forward messages received in the meantime which were not replayed.
+    self.joined = True
+    for packet in self.pending:
+      if packet.data.get('seq', 0) > last:
+        self.outbox.push(packet)
+    self.pending = None
+
+    # Handle messages the client sent before joining.
+    if self.inbox:
+      self.process_inbox_()
 
-  @coroutine
   def on_message(self, message):
+    """Queues an incoming message, handling messages in order."""
+
+    self.inbox.append(message)
+    if self.joined and len(self.inbox) == 1:
+      self.process_inbox_()
+
+  @coroutine
+  def process_inbox_(self):
+    """Handles queued messages one by one."""
+
+    while self.inbox:
+      try:
+        yield self.handle_message_(
+            protocol.decode(self.protocol, self.inbox[0]))
+      except Exception:
+        app_log.exception('Cannot handle message in scene %s', self.scene_id)
+      finally:
+        self.inbox.popleft()
+
+  @coroutine
+  def handle_message_(self, data):
     """Handles an incoming message."""
 
     if not self.user or not self.writeable:
       return
-    data = json.loads(message)
 
     # Name change request - update object.
     if data['type'] == 'name':
@@ -119,70 +284,77 @@ class WSHandler(WebSocketHandler, BaseHandler):
 
     # Request to lock on an object.
     if data['type'] == 'lock':
-      objects = []
-      for id in data['objects']:
-        key = 'scene:%s:%s' % (self.scene_id, id)
-        lock = self.redis.setnx(key, self.user.id)
-        if lock:
-          self.redis.expire(key, 60 * 10)
-          self.objects.add(id)
-          objects.append(id)
+      objects = yield self.locks.acquire(self.user.id, data['objects'])
+      self.objects.update(objects)
       data['objects'] = objects
 
     # Request to unlock objects.
     if data['type'] == 'unlock':
-      objects = []
-      for id in data['objects']:
-        self.redis.delete('scene:%s:%s' % (self.scene_id, id))
-        objects.append(id)
-        if id in self.objects:
-          self.objects.remove(id)
+      objects = yield self.locks.release(self.user.id, data['objects'])
+      self.objects.difference_update(objects)
       data['objects'] = objects
 
     # Broadcast the message, appending a seqnum.
-    if self.writeable:
-      seq = self.to_channel(data)
+    yield self.to_channel(data)
 
 
-  @coroutine
-  def on_channel(self, message):
+  def on_channel(self, packet):
     """Handles a message from the redis channel."""
 
-    if message.kind != 'message' or not self.open:
+    if not self.joined:
+      if self.pending is not None:
+        self.pending.append(packet)
       return
 
-    self.write_message(message.body)
+    self.outbox.push(packet)
 
 
   @coroutine
   def on_close(self):
-    """Handles connection termination."""
+    """Handles connection termination, unless the scene is still joined."""
 
-    # Stop sending messages.
-    self.open = False
-
-    # Leave the scene.
-    if self.user and self.writeable:
-      # Remove the user from the scene.
-      def remove_user(scene):
-        scene.remove_user(self.user.id)
-      yield self.update_scene_(remove_user)
-
-      # Unlock all objects.
-      for id in self.objects:
-        self.redis.delete('scene:%s:%s' % (self.scene_id, id))
-
-      # Leave the scene (of the crime).
-      user_id = self.user.id
-      self.user = None
-      self.to_channel({
-          'type': 'leave',
-          'user': user_id
-      })
+    self.closed = True
+    self.joined = False
+    if not self.opening:
+      yield self.leave_()
+
+  @coroutine
+  def leave_(self):
+    """Undoes the steps of joining the scene done so far."""
 
-    # Terminate the redis connection.
-    yield Task(self.chan.unsubscribe, self.chan_id)
-    yield Task(self.chan.disconnect)
+    # Stop sending messages.
+    if self.outbox is not None:
+      self.outbox.close()
+    WSHandler.sockets.discard(self)
+
+    try:
+      # Leave the scene.
+      if self.added:
+        self.added = False
+
+        # Remove the user from the scene.
+        yield self.redis.srem(self.users_id, self.user.id)
+
+        # Unlock all objects.
+        yield self.locks.release(self.user.id, self.objects)
+
+        # Leave the scene (of the crime).
+        user_id = self.user.id
+        self.user = None
+        yield self.to_channel({
+            'type': 'leave',
+            'user': user_id
+        })
+    finally:
+      # Write the scene back if this was the last editor.
+      if self.live is not None:
+        self.live.leave()
+        self.live = None
+
+      # Stop receiving messages from the channel.
+      if self.subscribed:
+        self.subscribed = False
+        self.application.hub.unsubscribe(self.chan_id, self)
 
 
   @coroutine
@@ -192,16 +364,14 @@ class WSHandler(WebSocketHandler, BaseHandler):
     #yield Task(self.lock.acquire, blocking=True)
 
     # Retrieve the scene object.
-    data = self.redis.hmget('scene:%s' % self.scene_id, [
-        'name',
-        'users'
-    ])
-
-    if data:
-      scene = Scene(self.scene_id,
-        name=data[0],
-        users=json.loads(data[1] or '[]')
-      )
+    data, users = yield [
+      self.redis.hgetall('scene:%s' % self.scene_id),
+      self.redis.smembers(self.users_id)
+    ]
+    users = sorted(int(user) for user in users)
+
+    if data.get('name') is not None:
+      scene = Scene(self.scene_id, name=data['name'], users=users)
     else:
       cursor = yield momoko.Op(self.db.execute,
         '''SELECT name FROM assets WHERE id = %(id)s''', {
@@ -209,17 +379,14 @@ class WSHandler(WebSocketHandler, BaseHandler):
       })
       scene = Scene(self.scene_id,
         name=cursor.fetchone()['name'],
-        users=[]
+        users=users
       )
 
     # Apply changes.
     func(scene)
 
     # Store the modified scene.
-    self.redis.hmset('scene:%s' % self.scene_id, {
-        'name': scene.name,
-        'users': json.dumps(scene.users)
-    })
+    yield self.redis.hset('scene:%s' % self.scene_id, 'name', scene.name)
 
     raise Return(scene)
 
@@ -227,42 +394,23 @@ class WSHandler(WebSocketHandler, BaseHandler):
   def to_channel(self, data):
     """Puts a message into the channel, tagging it with a seqnum."""
 
-    seq = self.redis.hincrby('scene:%s' % self.scene_id, 'seq', 1)
+    seq = yield self.redis.hincrby('scene:%s' % self.scene_id, 'seq', 1)
     data['seq'] = seq
-    self.redis.publish(self.chan_id, json.dumps(data))
-    return seq
+    yield [
+      self.oplog.append(data),
+      self.redis.publish(self.chan_id, json.dumps(data))
+    ]
+    metrics.PUBLISHED.inc(type=data.get('type'))
+    raise Return(seq)
 
   @coroutine
   def is_writeable(self):
     """Return None if no permission, False if read-only, True if writeable."""
 
-    # Fetch data from the asset and permission table.
-    # The write flag will have 3 possible values: None, True, False
-    cursor = yield momoko.Op(self.db.execute,
-      '''SELECT id, public, owner, write
-         FROM assets
-         LEFT OUTER JOIN permissions
-         ON permissions.asset_id = assets.id
-         WHERE assets.id = %(id)s
-           AND assets.type = 'scene'
-           AND (permissions.user_id = %(user)s OR
-                permissions.user_id is NULL OR
-                %(user)s IS NULL)
-      ''', {
-        'id': self.scene_id,
-        'user': self.user.id if self.user else None
-    })
-
-    data = cursor.fetchone()
-    if not data:
+    type, access = yield self.acl.resolve(self.scene_id, self.user)
+    if type != 'scene':
       raise HTTPError(404, 'Asset not found.')
 
-    if self.user and data['owner'] == self.user.id:
-      raise Return(True)
-    elif data['write'] is None:
-      if not data['public']:
-        raise Return(None)
-      else:
-        raise Return(False)
-    else:
-      raise Return(self.user is not None and data['write'])
+    if access == acl.NONE:
+      raise Return(None)
+    raise Return(access >= acl.WRITE)
@@ -0,0 +1,244 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import collections
+import errno
+import os
+import struct
+import time
+
+
+
+class ExportCache(object):
+  """Cache of exported scenes on local disk, shared by the workers.
+
+  Files are named after the asset, the digest of its data & the format, so an
+  entry is never stale: saving a scene changes the hash. The files of an asset
+  are kept in a directory of their own and dropped when it is updated. The
+  least recently used ones are evicted once the cache grows past its size,
+  down to a fraction of it so that the whole cache is rarely scanned.
+  """
+
+  # Size of the chunks cached files are read in.
+  CHUNK_SIZE = 64 * 1024
+
+  # Fraction of the size the cache is trimmed to by evictions.
+  LOW_WATER = 0.75
+
+  def __init__(self, path, max_size):
+    """Creates the cache directory & clears files of the old flat layout."""
+
+    self.path = path
+    self.max_size = max_size
+    self.makedirs_(path)
+    for name in os.listdir(path):
+      if os.path.isfile(os.path.join(path, name)):
+        self.remove_(os.path.join(path, name))
+    self.size = sum(size for _, _, size in self.entries_())
+
+  def key(self, id, digest, fmt):
+    """Returns the key of an export of some version of an asset.
+
+    Versions are told apart by the MD5 digest of their data.
+    """
+
+    return '%d-%s.%s' % (int(id), digest, fmt)
+
+  def path_(self, key):
+    """Returns the path of an entry, in the directory of its asset."""
+
+    return os.path.join(self.path, key.split('-', 1)[0], key)
+
+  def get(self, key):
+    """Returns the size & an iterator over the chunks of an entry or None."""
+
+    path = self.path_(key)
+    try:
+      os.utime(path, None)
+      f = open(path, 'rb')
+    except (IOError, OSError):
+      return None
+    return os.fstat(f.fileno()).st_size, self.read_(f)
+
+  def read_(self, f):
+    """Generates the chunks of a file, closing it when done."""
+
+    with f:
+      while True:
+        chunk = f.read(self.CHUNK_SIZE)
+        if not chunk:
+          return
+        yield chunk
+
+  def put(self, key, chunks):
+    """Generates the chunks of an export, storing them as they pass.
+
+    The entry is only added if all chunks were consumed, so exports abandoned
+    by clients are not cached.
+    """
+
+    path = self.path_(key)
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    self.makedirs_(os.path.dirname(path))
+    size = 0
+    done = False
+    try:
+      with open(temp, 'wb') as f:
+        for chunk in chunks:
+          f.write(chunk)
+          size += len(chunk)
+          yield chunk
+      os.rename(temp, path)
+      done = True
+    finally:
+      if not done:
+        self.remove_(temp)
+
+    self.size += size
+    if self.size > self.max_size:
+      self.evict_()
+
+  def drop(self, id):
+    """Removes all exports of an asset, listing only its directory."""
+
+    directory = os.path.join(self.path, str(int(id)))
+    try:
+      names = os.listdir(directory)
+    except OSError:
+      return
+    for name in names:
+      if name.endswith('.tmp'):
+        continue
+      try:
+        size = os.stat(os.path.join(directory, name)).st_size
+      except OSError:
+        continue
+      if self.remove_(os.path.join(directory, name)):
+        self.size -= size
+
+  def evict_(self):
+    """Removes the least recently used exports until the cache is trimmed."""
+
+    entries = sorted(self.entries_(), key=lambda entry: entry[1])
+    self.size = sum(size for _, _, size in entries)
+    for path, _, size in entries:
+      if self.size <= self.max_size * self.LOW_WATER:
+        break
+      if self.remove_(path):
+        self.size -= size
+
+  def entries_(self):
+    """Returns the path, last use & size of all cached exports."""
+
+    entries = []
+    for directory in os.listdir(self.path):
+      directory = os.path.join(self.path, directory)
+      try:
+        names = os.listdir(directory)
+      except OSError:
+        continue
+      for name in names:
+        if name.endswith('.tmp'):
+          continue
+        path = os.path.join(directory, name)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        entries.append((path, stat.st_mtime, stat.st_size))
+    return entries
+
+  def makedirs_(self, path):
+    """Creates a directory unless it exists."""
+
+    try:
+      os.makedirs(path)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+
+  def remove_(self, path):
+    """Removes a file, which another worker might have removed already."""
+
+    try:
+      os.remove(path)
+      return True
+    except OSError:
+      return False
+
+
+
+class ImageCache(object):
+  """Cache of converted textures, in memory & spilled to disk.
+
+  Recently used images are kept in a LRU in memory. They are also written to
+  the export cache, shared by the workers of the host, from which they are
+  loaded back once evicted from memory. Keys hold the digest of the source
+  image, so entries are never stale, but those of an asset are dropped when
+  it is updated.
+  """
+
+  # Header of spilled images: the time they were converted at.
+  HEADER = struct.Struct('<d')
+
+  def __init__(self, disk, max_size):
+    """Creates an empty cache in front of an export cache."""
+
+    self.disk = disk
+    self.max_size = max_size
+    self.size = 0
+    self.cache = collections.OrderedDict()
+
+  def key(self, id, digest, size, fmt):
+    """Returns the key of an image converted from some version of a level."""
+
+    return '%d-%s-%d.%s' % (int(id), digest, size, fmt)
+
+  def get(self, key):
+    """Returns an image & the time it was converted at or None."""
+
+    entry = self.cache.pop(key, None)
+    if entry is None:
+      cached = self.disk.get(key)
+      if cached is None:
+        return None
+      data = ''.join(cached[1])
+      if len(data) < self.HEADER.size:
+        return None
+      modified, = self.HEADER.unpack_from(data)
+      entry = (data[self.HEADER.size:], modified)
+      self.size += len(entry[0])
+
+    self.cache[key] = entry
+    self.evict_()
+    return entry
+
+  def put(self, key, data):
+    """Adds an image, returning it & the time it was converted at."""
+
+    entry = (data, time.time())
+    if key in self.cache:
+      self.size -= len(self.cache.pop(key)[0])
+    self.cache[key] = entry
+    self.size += len(data)
+    self.evict_()
+
+    for _ in self.disk.put(key, [self.HEADER.pack(entry[1]), data]):
+      pass
+    return entry
+
+  def drop(self, id):
+    """Removes all images of an asset."""
+
+    prefix = '%d-' % int(id)
+    for key in [key for key in self.cache if key.startswith(prefix)]:
+      self.size -= len(self.cache.pop(key)[0])
+    self.disk.drop(id)
+
+  def evict_(self):
+    """Removes the least recently used images from memory until it fits."""
+
+    while self.size > self.max_size and self.cache:
+      _, (data, _) = self.cache.popitem(last=False)
+      self.size -= len(data)
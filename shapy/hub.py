@@ -0,0 +1,71 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+from tornado.gen import Task, coroutine
+
+from shapy.protocol import Packet
+
+
+class Hub(object):
+  """Multiplexes redis channels over a single subscriber connection.
+
+  Each channel is subscribed to once per process, no matter how many local
+  websockets listen on it. Messages are then fanned out in memory to all the
+  handlers registered for the channel.
+  """
+
+  def __init__(self, client):
+    """Creates a hub on top of a tornadoredis client."""
+
+    self.client = client
+    self.client.connect()
+    self.handlers = {}
+    self.listening = False
+
+  @coroutine
+  def subscribe(self, channel, handler):
+    """Registers a handler, subscribing to the channel if needed."""
+
+    if channel in self.handlers:
+      self.handlers[channel].add(handler)
+      return
+
+    self.handlers[channel] = set([handler])
+    if self.listening:
+      yield Task(self.client.subscribe, channel)
+    else:
+      self.listening = True
+      yield Task(self.client.subscribe, channel)
+      self.client.listen(self.on_message)
+
+  def unsubscribe(self, channel, handler):
+    """Removes a handler, unsubscribing once the channel has no listeners."""
+
+    handlers = self.handlers.get(channel)
+    if handlers is None:
+      return
+
+    handlers.discard(handler)
+    if not handlers:
+      del self.handlers[channel]
+      self.client.unsubscribe(channel)
+
+  def count(self, channel):
+    """Returns the number of local handlers listening on a channel."""
+
+    return len(self.handlers.get(channel, ()))
+
+  def on_message(self, message):
+    """Forwards a message to all handlers listening on its channel."""
+
+    if message.kind == 'unsubscribe' and not message.body:
+      # Redis leaves pub/sub mode once no channels are subscribed.
+      self.listening = False
+      return
+    if message.kind != 'message':
+      return
+
+    packet = Packet(message.body)
+    for handler in list(self.handlers.get(message.channel, ())):
+      handler.on_channel(packet)
@@ -0,0 +1,227 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import base64
+import cStringIO
+import hashlib
+import re
+import struct
+
+import momoko
+import psycopg2
+from PIL import Image
+from tornado.gen import coroutine
+from tornado.log import app_log
+
+
+# Size of the box previews of textures are fitted in.
+PREVIEW_SIZE = (150, 150)
+
+# Images uploaded & formerly stored as data URLs.
+DATA_URL = re.compile('^data:(image/[-+.\w]+);base64,')
+
+# Header of stored textures: marker, MIME type, width, height, size of the
+# image & number of levels, followed by the width, height, offset & size of
+# each level. The image comes next, then its levels, largest first.
+MAGIC = 'SHPYTEX2'
+HEADER = struct.Struct('<8s32sIIII')
+LEVEL = struct.Struct('<IIII')
+
+# Header of textures stored without levels.
+MAGIC_V1 = 'SHPYTEX1'
+HEADER_V1 = struct.Struct('<8s32sII')
+
+# Sizes of the boxes the downscaled levels of textures are fitted in.
+LEVELS = (2048, 1024, 512, 256)
+
+# Number of bytes holding the header of any stored texture.
+MAX_HEADER = HEADER.size + LEVEL.size * len(LEVELS)
+
+# Size of the chunks stored images are streamed in.
+CHUNK_SIZE = 64 * 1024
+
+
+def is_packed(data):
+  """Checks if a texture is stored as raw bytes rather than a data URL."""
+
+  return data[:len(MAGIC)] in (MAGIC, MAGIC_V1)
+
+
+def level_mime(mime):
+  """Returns the MIME type of the levels of an image, png unless jpeg."""
+
+  return mime if mime == 'image/jpeg' else 'image/png'
+
+
+def read_header(data, size):
+  """Parses the header of a stored texture, given its first bytes & size.
+
+  Returns the image, then its levels, as (MIME type, width, height, offset,
+  length) tuples.
+  """
+
+  if data[:len(MAGIC_V1)] == MAGIC_V1:
+    _, mime, width, height = HEADER_V1.unpack_from(data)
+    mime = mime.rstrip('\0')
+    return [(mime, width, height, HEADER_V1.size, size - HEADER_V1.size)]
+
+  _, mime, width, height, length, count = HEADER.unpack_from(data)
+  mime = mime.rstrip('\0')
+  images = [(mime, width, height, HEADER.size + LEVEL.size * count, length)]
+  for i in range(count):
+    width, height, offset, length = LEVEL.unpack_from(
+        data, HEADER.size + LEVEL.size * i)
+    images.append((level_mime(mime), width, height, offset, length))
+  return images
+
+
+def select(images, size):
+  """Picks the smallest image covering a box of some size, or the largest.
+
+  The largest image is also picked if size is None.
+  """
+
+  if size is None:
+    return images[0]
+  for image in sorted(images, key=lambda image: max(image[1:3])):
+    if max(image[1:3]) >= size:
+      return image
+  return images[0]
+
+
+def unpack(data):
+  """Returns the MIME type, width, height & bytes of a stored texture.
+
+  The bytes are a buffer over the stored data, so they are not copied.
+  Textures still stored as data URLs are decoded, without dimensions.
+  """
+
+  if is_packed(data):
+    mime, width, height, offset, length = read_header(data, len(data))[0]
+    return mime, width, height, buffer(data, offset, length)
+
+  data = str(data)
+  match = DATA_URL.match(data)
+  if not match:
+    raise ValueError('Unknown texture encoding')
+  try:
+    raw = base64.b64decode(data[match.end():])
+  except TypeError:
+    raise ValueError('Malformed base64 data')
+  return match.group(1), 0, 0, raw
+
+
+def write(mime, width, height, raw, levels=[]):
+  """Builds a stored texture from an image & its (width, height, bytes) levels."""
+
+  header = [HEADER.pack(MAGIC, mime, width, height, len(raw), len(levels))]
+  offset = HEADER.size + LEVEL.size * len(levels) + len(raw)
+  for level_width, level_height, level in levels:
+    header.append(LEVEL.pack(level_width, level_height, offset, len(level)))
+    offset += len(level)
+  return ''.join(header + [str(raw)] + [level for _, _, level in levels])
+
+
+def pack(data):
+  """Converts an image given as a data URL into the form textures are stored in.
+
+  Decoding large images is slow, so this is meant to run in a process pool.
+  """
+
+  _, _, _, raw = unpack(data)
+  image = Image.open(cStringIO.StringIO(raw))
+  mime = Image.MIME.get(image.format)
+  if not mime:
+    raise ValueError('Unknown image format')
+  return write(mime, image.size[0], image.size[1], raw)
+
+
+def add_levels(data):
+  """Adds downscaled levels to a stored texture, or returns None if too small.
+
+  Each level is scaled down from the previous one, which is much faster than
+  starting from the image each time. This is meant to run in a process pool.
+  """
+
+  mime, width, height, raw = unpack(data)
+  if max(width, height) <= LEVELS[-1]:
+    return None
+
+  image = Image.open(cStringIO.StringIO(raw))
+  fmt = level_mime(mime)[len('image/'):]
+  if fmt == 'jpeg' and image.mode not in ('L', 'RGB'):
+    image = image.convert('RGB')
+  elif fmt == 'png' and image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+    image = image.convert('RGBA')
+
+  levels = []
+  for size in LEVELS:
+    if size >= max(image.size):
+      continue
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    stream = cStringIO.StringIO()
+    image.save(stream, fmt)
+    levels.append((image.size[0], image.size[1], stream.getvalue()))
+  return write(mime, width, height, raw, levels)
+
+
+def decode(data):
+  """Opens a stored texture."""
+
+  return Image.open(cStringIO.StringIO(unpack(data)[3]))
+
+
+def store(data):
+  """Converts an uploaded image into its stored form & a JPEG data URL preview.
+
+  Decoding large images is slow, so this is meant to run in a process pool.
+  """
+
+  data = pack(data)
+  image = decode(data).convert('RGB')
+  image.thumbnail(PREVIEW_SIZE, Image.ANTIALIAS)
+
+  stream = cStringIO.StringIO()
+  image.save(stream, format='JPEG')
+  preview = 'data:image/jpeg;base64,%s' % base64.b64encode(stream.getvalue())
+  return data, preview
+
+
+def convert(raw, fmt):
+  """Encodes the bytes of an image in another format, such as png.
+
+  Decoding large images is slow, so this is meant to run in a process pool.
+  """
+
+  image = Image.open(cStringIO.StringIO(raw))
+  if fmt == 'jpeg' and image.mode not in ('L', 'RGB', 'CMYK'):
+    image = image.convert('RGB')
+
+  stream = cStringIO.StringIO()
+  image.save(stream, fmt)
+  return stream.getvalue()
+
+
+@coroutine
+def update_levels(app, id, data):
+  """Adds levels to a stored texture in the process pool & saves them."""
+
+  try:
+    levels = yield app.executor.run(add_levels, data)
+    if levels is None:
+      return
+
+    # The texture might have been replaced in the meantime.
+    yield momoko.Op(app.db.execute,
+      '''UPDATE assets
+         SET data = %(levels)s
+         WHERE id = %(id)s
+           AND md5(data) = %(md5)s
+      ''', {
+      'id': id,
+      'levels': psycopg2.Binary(levels),
+      'md5': hashlib.md5(data).hexdigest()
+    })
+  except Exception:
+    app_log.exception('Cannot build levels of texture %s', id)
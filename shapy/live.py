@@ -0,0 +1,262 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import json
+import momoko
+import time
+
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+
+from shapy.oplog import OpLog
+from shapy.render import update_preview
+from shapy.scene import Scene
+
+
+class LiveScene(object):
+  """Copy of a scene being edited, kept up to date by the server.
+
+  Edits broadcast on the channel of the scene are applied to the copy, which
+  is written back to the database periodically and when the last user leaves.
+  If an edit cannot be applied by the server, the copy becomes stale and is not
+  written until a client uploads the whole scene again. Clients are told so
+  through the channel of the scene, so edits are never dropped silently.
+
+  Each worker process editing a scene keeps its own copy, but only the one
+  holding the lease of the scene in redis writes it back.
+  """
+
+  # Number of seconds between writes of modified scenes.
+  FLUSH_INTERVAL = 10
+
+  # Minimum number of seconds between renders of the preview of a scene.
+  PREVIEW_INTERVAL = 60
+
+  # Scenes being edited, by ID.
+  scenes = {}
+
+  # Scenes being written back after the last user left, by ID.
+  closing = {}
+
+  # Takes or extends the lease of a scene if it is free or held by the worker.
+  # ARGV holds the worker and the duration of the lease.
+  LEASE = '''
+    local owner = redis.call('GET', KEYS[1])
+    if owner and owner ~= ARGV[1] then
+      return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+  '''
+
+  # Gives up the lease of a scene if it is held by the worker.
+  UNLEASE = '''
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+      redis.call('DEL', KEYS[1])
+    end
+  '''
+
+  def __init__(self, app, scene_id):
+    """Creates a copy of a scene, loaded when the first user joins."""
+
+    self.app = app
+    self.id = scene_id
+    self.chan_id = 'chan_%s' % scene_id
+    self.live_id = 'live_%s' % scene_id
+    self.lease_id = 'lease:%s' % scene_id
+    self.oplog = OpLog(app.redis, scene_id)
+    self.lease_ = app.redis.register_script(self.LEASE)
+    self.unlease_ = app.redis.register_script(self.UNLEASE)
+    self.users = 0
+    self.scene = None
+    self.queue = []
+    self.dirty = False
+    self.stale = False
+    self.previewed = 0
+    self.closed = None
+
+  @classmethod
+  def join(cls, app, scene_id):
+    """Returns the live copy of a scene, loading it if necessary."""
+
+    live = cls.scenes.get(scene_id)
+    if live is None:
+      live = cls.scenes[scene_id] = LiveScene(app, scene_id)
+      live.start_()
+    live.users += 1
+    return live
+
+  def leave(self):
+    """Writes the scene back & drops it when the last user leaves."""
+
+    self.users -= 1
+    if self.users > 0:
+      return
+
+    if self.scenes.get(self.id) is self:
+      del self.scenes[self.id]
+    self.app.hub.unsubscribe(self.chan_id, self)
+    self.app.hub.unsubscribe(self.live_id, self)
+    self.closing[self.id] = self
+    self.closed = self.close_()
+
+  @classmethod
+  def flush_all(cls):
+    """Writes back all modified scenes."""
+
+    for live in cls.scenes.values():
+      live.flush()
+
+  @classmethod
+  def reload(cls, redis, scene_id):
+    """Tells all workers to load a scene again after it was uploaded."""
+
+    return redis.publish('live_%s' % scene_id, json.dumps({'type': 'reload'}))
+
+  @coroutine
+  def start_(self):
+    """Listens on the channels of the scene & loads it.
+
+    If the previous copy of the scene in this worker is still being written
+    back, it is waited for, so the two copies never race to write the scene.
+    """
+
+    previous = self.closing.get(self.id)
+    if previous is not None:
+      yield previous.closed
+
+    yield [
+      self.app.hub.subscribe(self.chan_id, self),
+      self.app.hub.subscribe(self.live_id, self)
+    ]
+    yield self.load()
+
+  @coroutine
+  def close_(self):
+    """Writes the scene back & lets other workers take over."""
+
+    try:
+      yield self.flush()
+      yield self.unlease_(keys=[self.lease_id], args=[self.app.WORKER_ID])
+    except Exception:
+      app_log.exception('Cannot release scene %s', self.id)
+    finally:
+      if self.closing.get(self.id) is self:
+        del self.closing[self.id]
+
+  @coroutine
+  def load(self):
+    """Reads the stored scene & replays the operations applied since."""
+
+    self.scene = None
+    self.dirty = False
+    self.stale = False
+    try:
+      cursor = yield momoko.Op(self.app.db.execute,
+        '''SELECT name, data FROM assets WHERE id = %(id)s''', {
+        'id': self.id
+      })
+      data = cursor.fetchone()
+      scene = Scene(data['name'], json.loads(str(data['data'] or 'null')) or {
+        'id': self.id,
+        'objects': {}
+      })
+
+      # If operations were discarded, the scene must be uploaded again.
+      ops = yield self.oplog.since(scene.seq)
+      if ops is None:
+        self.mark_stale_()
+        ops = []
+    except Exception:
+      app_log.exception('Cannot load scene %s', self.id)
+      self.mark_stale_()
+      return
+
+    # Apply the log & messages received while loading, in order.
+    self.scene = scene
+    ops.extend(self.queue)
+    self.queue = []
+    for data in sorted(ops, key=lambda op: op.get('seq', 0)):
+      self.apply(data)
+
+  def on_channel(self, packet):
+    """Handles a message from the redis channels."""
+
+    if packet.data.get('type') == 'reload':
+      self.load()
+      return
+
+    if self.scene is None:
+      if not self.stale:
+        self.queue.append(packet.data)
+      return
+
+    self.apply(packet.data)
+
+  def apply(self, data):
+    """Applies a message to the scene."""
+
+    seq = data.get('seq', 0)
+    if seq <= self.scene.seq:
+      return
+    self.scene.seq = seq
+    if data.get('type') not in ('create', 'edit'):
+      return
+
+    try:
+      applied = self.scene.apply(data)
+    except Exception:
+      app_log.exception('Cannot apply edit to scene %s', self.id)
+      applied = False
+
+    if applied:
+      self.dirty = True
+    else:
+      self.mark_stale_()
+
+  def mark_stale_(self):
+    """Stops writing the scene & asks clients to upload it again."""
+
+    if self.stale:
+      return
+    self.stale = True
+    IOLoop.current().spawn_callback(
+        self.app.redis.publish, self.chan_id, json.dumps({ 'type': 'stale' }))
+
+  @coroutine
+  def flush(self):
+    """Writes the scene to the database if it was modified."""
+
+    if not self.dirty or self.stale or self.scene is None:
+      return
+
+    try:
+      # Another worker writes the scene while it holds the lease.
+      owner = yield self.lease_(
+          keys=[self.lease_id],
+          args=[self.app.WORKER_ID, self.FLUSH_INTERVAL * 3])
+      if not owner or self.stale or self.scene is None:
+        return
+
+      self.dirty = False
+      seq = self.scene.seq
+      data = json.dumps(self.scene.to_json())
+      yield momoko.Op(self.app.db.execute,
+        '''UPDATE assets
+           SET data = %(data)s
+           WHERE id = %(id)s
+        ''', {
+        'id': self.id,
+        'data': data
+      })
+      yield self.oplog.snapshot(seq)
+
+      now = time.time()
+      if now - self.previewed >= self.PREVIEW_INTERVAL:
+        self.previewed = now
+        IOLoop.current().spawn_callback(update_preview, self.app, self.id, data)
+    except Exception:
+      app_log.exception('Cannot store scene %s', self.id)
+      self.dirty = True
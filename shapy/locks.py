@@ -0,0 +1,100 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import time
+
+from tornado.gen import Return, coroutine
+
+from shapy import metrics
+
+
+class Locks(object):
+  """Locks on the objects of a scene, acquired and released in batches.
+
+  All locks of a scene live in a single redis hash, mapping object IDs to
+  'user:expiry' pairs, so that every lock can be read in one call. Every batch
+  is a single server-side script, locking a whole selection atomically in one
+  round trip.
+  """
+
+  # Locks expire in 10 minutes if not released.
+  EXPIRE = 60 * 10
+
+  # Locks all free objects, returning the indices of the acquired ones.
+  # ARGV holds the user, the current time, the expiry and the object IDs.
+  ACQUIRE = '''
+    local granted = {}
+    local expiry = tonumber(ARGV[2]) + tonumber(ARGV[3])
+    for i = 4, #ARGV do
+      local holder = redis.call('HGET', KEYS[1], ARGV[i])
+      if not holder or
+         tonumber(string.match(holder, ':(%d+)$')) <= tonumber(ARGV[2]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[1] .. ':' .. expiry)
+        table.insert(granted, i - 3)
+      end
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return granted
+  '''
+
+  # Unlocks objects held by a user, returning the indices of the released ones.
+  # ARGV holds the user and the object IDs.
+  RELEASE = '''
+    local released = {}
+    for i = 2, #ARGV do
+      local holder = redis.call('HGET', KEYS[1], ARGV[i])
+      if holder and string.match(holder, '^(%d+):') == ARGV[1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        table.insert(released, i - 1)
+      end
+    end
+    return released
+  '''
+
+  def __init__(self, redis, scene_id):
+    """Creates a wrapper around the locks of a scene."""
+
+    self.redis = redis
+    self.key = 'locks:%s' % scene_id
+    self.acquire_ = redis.register_script(self.ACQUIRE)
+    self.release_ = redis.register_script(self.RELEASE)
+
+  @coroutine
+  def acquire(self, user_id, ids):
+    """Locks objects for a user, returning the list of granted ones."""
+
+    ids = list(ids)
+    if not ids:
+      raise Return([])
+
+    granted = yield self.acquire_(
+        keys=[self.key],
+        args=[user_id, int(time.time()), self.EXPIRE] + ids)
+    metrics.LOCKS.inc(len(granted), result='granted')
+    metrics.LOCKS.inc(len(ids) - len(granted), result='denied')
+    raise Return([ids[i - 1] for i in granted])
+
+  @coroutine
+  def release(self, user_id, ids):
+    """Unlocks objects held by a user, returning the list of released ones."""
+
+    ids = list(ids)
+    if not ids:
+      raise Return([])
+
+    released = yield self.release_(keys=[self.key], args=[user_id] + ids)
+    raise Return([ids[i - 1] for i in released])
+
+  @coroutine
+  def held(self):
+    """Returns a map of all locked objects to the users holding them."""
+
+    now = int(time.time())
+    holders = yield self.redis.hgetall(self.key)
+    locks = {}
+    for id, holder in holders.iteritems():
+      user, expiry = holder.split(':')
+      if int(expiry) > now:
+        locks[id] = int(user)
+    raise Return(locks)
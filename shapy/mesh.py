@@ -0,0 +1,289 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import array
+import json
+import math
+import struct
+
+import numpy as np
+
+from shapy.scene import CHUNK_ROWS, STLB_TRIANGLE
+
+
+# Number of bytes of text parsed at once.
+CHUNK_BYTES = 1 << 22
+
+# Largest scene an import may produce. Scenes are built, stored & rendered in
+# memory, being copied a few times on the way.
+MAX_SCENE_SIZE = 128 * 1024 * 1024
+
+
+def read_lines(f):
+  """Generates the lines of a file in large batches."""
+
+  rest = ''
+  while True:
+    data = f.read(CHUNK_BYTES)
+    if not data:
+      if rest:
+        yield [rest]
+      return
+    lines = (rest + data).split('\n')
+    rest = lines.pop()
+    yield lines
+
+
+def parse_numbers(parts, width):
+  """Parses strings of space separated numbers into an array of rows."""
+
+  values = np.fromstring(' '.join(parts), dtype=np.float64, sep=' ')
+  if len(values) != len(parts) * width:
+    raise ValueError('Malformed coordinates')
+  return values.reshape(-1, width)
+
+
+def parse_stl(f):
+  """Parses an ASCII STL file, returning the corners of each solid.
+
+  Each row of the (faces, 9) arrays holds the 3 corners of a face.
+  """
+
+  solids = []
+  chunks, parts = [], []
+  for lines in read_lines(f):
+    for line in lines:
+      line = line.strip()
+      if line.startswith('vertex'):
+        parts.append(line[6:])
+      elif line.startswith('solid') and (parts or chunks):
+        chunks.append(parse_numbers(parts, 3))
+        solids.append(np.concatenate(chunks))
+        chunks, parts = [], []
+    chunks.append(parse_numbers(parts, 3))
+    parts = []
+  solids.append(np.concatenate(chunks or [np.zeros((0, 3))]))
+
+  if any(len(corners) % 3 for corners in solids):
+    raise ValueError('Incomplete facet')
+  return [corners.reshape(-1, 9) for corners in solids if len(corners)]
+
+
+def parse_stlb(f):
+  """Parses a binary STL file, returning the corners of its only solid."""
+
+  header = f.read(84)
+  if len(header) != 84:
+    raise ValueError('Truncated header')
+  count, = struct.unpack('<I', header[80:])
+
+  triangles = np.fromstring(f.read(count * STLB_TRIANGLE.itemsize),
+                            dtype=STLB_TRIANGLE)
+  if len(triangles) != count:
+    raise ValueError('Truncated triangles')
+  return [triangles['data'][:, 3:].astype(np.float64)]
+
+
+def parse_obj(f):
+  """Parses a wavefront obj file into meshes, one per object.
+
+  Meshes are (positions, faces, uvs, face_uvs) tuples, faces indexing
+  the rows of the positions and face_uvs those of uvs. Polygons are split into
+  triangle fans and face_uvs is None unless all faces have UV coordinates.
+  """
+
+  verts, uvs = [], []
+  vert_chunks, uv_chunks = [], []
+  vert_count, uv_count = 0, 0
+  objects = [(array.array('l'), array.array('l'))]
+
+  for lines in read_lines(f):
+    for line in lines:
+      kind, _, rest = line.strip().partition(' ')
+      if kind == 'v':
+        # Extra components, such as colors or weights, are dropped.
+        verts.append(' '.join(rest.split()[:3]))
+        vert_count += 1
+      elif kind == 'vt':
+        uvs.append(' '.join(rest.split()[:2]))
+        uv_count += 1
+      elif kind == 'f':
+        corners = []
+        for corner in rest.split():
+          indices = corner.split('/')
+          vert = int(indices[0])
+          uv = int(indices[1]) if len(indices) > 1 and indices[1] else 0
+          corners.append((
+            vert - 1 if vert > 0 else vert_count + vert,
+            uv - 1 if uv > 0 else uv_count + uv if uv else -1
+          ))
+        faces, face_uvs = objects[-1]
+        for i in range(1, len(corners) - 1):
+          for vert, uv in (corners[0], corners[i], corners[i + 1]):
+            faces.append(vert)
+            face_uvs.append(uv)
+      elif kind == 'o':
+        objects.append((array.array('l'), array.array('l')))
+
+    vert_chunks.append(parse_numbers(verts, 3))
+    uv_chunks.append(parse_numbers(uvs, 2))
+    verts, uvs = [], []
+
+  positions = np.concatenate(vert_chunks)
+  uvs = np.concatenate(uv_chunks)
+
+  meshes = []
+  for faces, face_uvs in objects:
+    if not faces:
+      continue
+    faces = np.frombuffer(faces, dtype=np.int_).astype(np.int64).reshape(-1, 3)
+    face_uvs = np.frombuffer(face_uvs, dtype=np.int_).astype(np.int64)
+    if faces.min() < 0 or faces.max() >= len(positions):
+      raise ValueError('Unknown vertex')
+    if face_uvs.min() < 0:
+      face_uvs = None
+    elif face_uvs.max() >= len(uvs):
+      raise ValueError('Unknown UV point')
+    else:
+      face_uvs = face_uvs.reshape(-1, 3)
+    meshes.append((positions, faces, uvs, face_uvs))
+  return meshes
+
+
+def compact(points, indices):
+  """Keeps the rows of points referenced by indices, numbering them anew."""
+
+  rows, indices = np.unique(indices, return_inverse=True)
+  return points[rows], indices.reshape(-1, 3)
+
+
+def weld(corners):
+  """Merges identical corners, returning positions & faces indexing them."""
+
+  # Adding zero turns negative zeros into positive ones.
+  corners = np.ascontiguousarray(corners.reshape(-1, 3) + 0.0)
+  keys = corners.view(np.dtype((np.void, corners.dtype.itemsize * 3)))
+  _, rows, indices = np.unique(keys.ravel(), True, True)
+  return corners[rows], indices.reshape(-1, 3)
+
+
+def project(positions):
+  """Projects vertices onto a sphere, like the editor does for new faces."""
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    n = positions / np.sqrt((positions * positions).sum(axis=1))[:, None]
+  n = np.nan_to_num(n)
+  return np.column_stack((
+    0.5 + np.arctan2(n[:, 2], n[:, 0]) / (2 * math.pi),
+    0.5 - np.arcsin(np.clip(n[:, 1], -1, 1)) / math.pi
+  ))
+
+
+def to_edges(faces):
+  """Builds the edges of triangles, as (edges, signed face edges).
+
+  Edges shared by faces are stored once, from the lower to the higher point.
+  IDs start at 1 since the sign of an edge gives its direction in a face.
+  """
+
+  start = faces.ravel()
+  end = faces[:, [1, 2, 0]].ravel()
+  low, high = np.minimum(start, end), np.maximum(start, end)
+  base = faces.max() + 1
+  keys, rows = np.unique(low * base + high, return_inverse=True)
+  edges = np.column_stack((keys // base, keys % base))
+  return edges, np.where(start == low, rows + 1, -(rows + 1)).reshape(-1, 3)
+
+
+def dump_rows(values, template):
+  """Generates the members of a JSON map of IDs, numbered from 1, to rows.
+
+  Rows are formatted straight from the array, a chunk at a time, since a dict
+  holding millions of lists would take gigabytes.
+  """
+
+  for start in xrange(0, len(values), CHUNK_ROWS):
+    chunk = values[start:start + CHUNK_ROWS]
+    rows = np.column_stack((
+      np.arange(start + 1, start + len(chunk) + 1, dtype=chunk.dtype), chunk
+    ))
+    yield (template * len(rows) % tuple(rows.ravel().tolist()))[:-1]
+
+
+def dump_object(id, positions, faces, uvs=None, face_uvs=None,
+                limit=MAX_SCENE_SIZE):
+  """Converts a triangle mesh into the JSON of an object of a scene.
+
+  Points are numbered from 1, like the editor does, and coordinates are
+  truncated to 3 decimals. The JSON may not grow past limit bytes.
+  """
+
+  positions, faces = compact(positions, faces)
+  if not np.isfinite(positions).all():
+    raise ValueError('Invalid coordinates')
+  if face_uvs is None:
+    uvs, face_uvs = project(positions), faces
+  else:
+    uvs, face_uvs = compact(uvs, face_uvs)
+    if not np.isfinite(uvs).all():
+      raise ValueError('Invalid texture coordinates')
+
+  edges, face_edges = to_edges(faces)
+  uv_edges, face_uv_edges = to_edges(face_uvs)
+
+  maps = (
+    ('verts', '"%d":[%r,%r,%r],', np.floor(positions * 1000) / 1000),
+    ('edges', '"%d":[%d,%d],', edges + 1),
+    ('faces', '"%d":[%d,%d,%d,%d,%d,%d],',
+        np.hstack((face_edges, face_uv_edges))),
+    ('uvPoints', '"%d":[%r,%r],', np.floor(uvs * 1000) / 1000),
+    ('uvEdges', '"%d":[%d,%d],', uv_edges + 1)
+  )
+
+  out = [json.dumps({
+    'id': id,
+    'tx': 0.0, 'ty': 0.0, 'tz': 0.0,
+    'sx': 1.0, 'sy': 1.0, 'sz': 1.0,
+    'rx': 0.0, 'ry': 0.0, 'rz': 0.0, 'rw': 1.0,
+    'texture': None
+  })[:-1]]
+  size = len(out[0]) + 1
+  for key, template, values in maps:
+    out.append(',"%s":{' % key)
+    size += len(out[-1]) + 1
+    for i, rows in enumerate(dump_rows(values, template)):
+      out.append(',' + rows if i else rows)
+      size += len(out[-1])
+      if size > limit:
+        raise ValueError('Scene too large')
+    out.append('}')
+  out.append('}')
+  return ''.join(out)
+
+
+def import_mesh(path, fmt):
+  """Converts an obj, stl or binary stl file into the JSON data of a scene.
+
+  This is slow for large meshes, so it is meant to run in a process pool.
+  Scenes larger than MAX_SCENE_SIZE are rejected.
+  """
+
+  with open(path, 'rb') as f:
+    if fmt == 'obj':
+      meshes = parse_obj(f)
+    elif fmt == 'stl':
+      meshes = [weld(corners) + (None, None) for corners in parse_stl(f)]
+    elif fmt == 'stlb':
+      meshes = [weld(corners) + (None, None) for corners in parse_stlb(f)]
+    else:
+      raise ValueError('Format not supported')
+
+  objects, size = [], len('{"seq":0,"objects":{}}')
+  for i, mesh in enumerate(meshes):
+    name = '"import_%d":' % i
+    size += len(name) + (1 if objects else 0)
+    data = dump_object('import_%d' % i, *mesh, limit=MAX_SCENE_SIZE - size)
+    size += len(data)
+    objects.append(name + data)
+  return '{"seq":0,"objects":{%s}}' % ','.join(objects)
@@ -0,0 +1,230 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import bisect
+import collections
+import hmac
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.log import access_log
+from tornado.web import HTTPError, RequestHandler
+
+
+# Upper bounds of the latency histograms, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# All metrics, in the order they are exported.
+registry = []
+
+
+
+class Metric(object):
+  """Base class of metrics, holding values by labels."""
+
+  TYPE = None
+
+  def __init__(self, name, help, func=None):
+    """Creates a metric & registers it.
+
+    If func is given, it is called on export to return (labels, value) pairs,
+    labels being a dictionary.
+    """
+
+    self.name = name
+    self.help = help
+    self.func = func
+    self.values = collections.defaultdict(float)
+    registry.append(self)
+
+  def samples(self):
+    """Returns (suffix, labels, value) tuples."""
+
+    if self.func is not None:
+      return [
+        ('', tuple(sorted(labels.items())), value)
+        for labels, value in self.func()
+      ]
+    return [('', labels, value) for labels, value in self.values.items()]
+
+  def render(self):
+    """Formats the metric in the Prometheus text format."""
+
+    lines = [
+      '# HELP %s %s' % (self.name, self.help),
+      '# TYPE %s %s' % (self.name, self.TYPE)
+    ]
+    for suffix, labels, value in sorted(self.samples()):
+      if labels:
+        lines.append('%s%s{%s} %s' % (self.name, suffix, ','.join(
+            '%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels
+        ), repr(float(value))))
+      else:
+        lines.append('%s%s %s' % (self.name, suffix, repr(float(value))))
+    return '\n'.join(lines)
+
+
+
+class Counter(Metric):
+  """Monotonically increasing count."""
+
+  TYPE = 'counter'
+
+  def inc(self, value=1, **labels):
+    """Increments the count."""
+
+    self.values[tuple(sorted(labels.items()))] += value
+
+
+
+class Gauge(Metric):
+  """Value which is either set or computed when exported."""
+
+  TYPE = 'gauge'
+
+  def set(self, value, **labels):
+    """Sets the value."""
+
+    self.values[tuple(sorted(labels.items()))] = value
+
+
+
+class Histogram(Metric):
+  """Distribution of observed values, such as latencies."""
+
+  TYPE = 'histogram'
+
+  def __init__(self, name, help, buckets=BUCKETS):
+    """Creates an empty histogram."""
+
+    super(Histogram, self).__init__(name, help)
+    self.buckets = buckets
+    self.counts = {}
+    self.sums = collections.defaultdict(float)
+
+  def observe(self, value, **labels):
+    """Records a value."""
+
+    labels = tuple(sorted(labels.items()))
+    if labels not in self.counts:
+      self.counts[labels] = [0] * (len(self.buckets) + 1)
+    self.counts[labels][bisect.bisect_left(self.buckets, value)] += 1
+    self.sums[labels] += value
+
+  def samples(self):
+    """Returns cumulative bucket counts, sums & counts."""
+
+    samples = []
+    for labels, counts in self.counts.items():
+      total = 0
+      for bound, count in zip(self.buckets + ('+Inf',), counts):
+        total += count
+        samples.append(('_bucket', labels + (('le', bound),), total))
+      samples.append(('_sum', labels, self.sums[labels]))
+      samples.append(('_count', labels, total))
+    return samples
+
+
+
+# Latency of HTTP requests & websocket handshakes.
+REQUESTS = Histogram(
+    'shapy_request_seconds', 'Latency of requests by handler.')
+
+# Latency of resolving sessions.
+SESSIONS = Histogram(
+    'shapy_session_seconds', 'Latency of looking up session tokens.')
+
+# Messages sent through the channels of scenes.
+PUBLISHED = Counter(
+    'shapy_messages_published_total', 'Messages published to scenes.')
+
+# Messages written to websockets.
+DELIVERED = Counter(
+    'shapy_messages_delivered_total', 'Messages written to websockets.')
+
+# Lock requests.
+LOCKS = Counter(
+    'shapy_locks_total', 'Objects locked or denied by result.')
+
+# Latency of redis commands.
+REDIS = Histogram(
+    'shapy_redis_seconds', 'Latency of redis commands.')
+
+# Latency of database queries.
+DATABASE = Histogram(
+    'shapy_database_seconds', 'Latency of database queries.')
+
+# Latency of jobs run in the process pool.
+JOBS = Histogram(
+    'shapy_job_seconds', 'Latency of jobs run in the process pool.')
+
+# Jobs queued or running in the process pool.
+JOBS_PENDING = Gauge(
+    'shapy_jobs_pending', 'Jobs queued or running in the process pool.')
+
+# Jobs refused since the process pool was full.
+JOBS_REJECTED = Counter(
+    'shapy_jobs_rejected_total', 'Jobs refused by the full process pool.')
+
+# Delay of callbacks scheduled on the IOLoop.
+LAG = Gauge(
+    'shapy_ioloop_lag_seconds', 'Delay of callbacks scheduled on the IOLoop.')
+
+
+def log_request(handler):
+  """Records the latency of a request & logs it like tornado does."""
+
+  request_time = handler.request.request_time()
+  REQUESTS.observe(request_time, handler=type(handler).__name__)
+
+  if handler.get_status() < 400:
+    log_method = access_log.info
+  elif handler.get_status() < 500:
+    log_method = access_log.warning
+  else:
+    log_method = access_log.error
+  log_method('%d %s %.2fms', handler.get_status(),
+             handler._request_summary(), 1000.0 * request_time)
+
+
+def monitor_lag(interval=1.0):
+  """Periodically measures how long the IOLoop takes to run a callback."""
+
+  def measure():
+    io_loop = IOLoop.current()
+    start = io_loop.time()
+    io_loop.add_callback(lambda: LAG.set(io_loop.time() - start))
+
+  PeriodicCallback(measure, interval * 1000).start()
+
+
+def render():
+  """Formats all metrics in the Prometheus text format."""
+
+  return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+
+class MetricsHandler(RequestHandler):
+  """Exports the metrics of the process.
+
+  Scrapers must send the METRICS_TOKEN setting as a bearer token. If it is
+  not set, only requests from the host itself are served.
+  """
+
+  # Addresses of the host itself.
+  LOCAL = ('127.0.0.1', '::1')
+
+  def get(self):
+    """Writes all metrics."""
+
+    token = self.application.METRICS_TOKEN
+    if token:
+      auth = self.request.headers.get('Authorization', '')
+      if not hmac.compare_digest(str(auth), 'Bearer %s' % token):
+        raise HTTPError(403)
+    elif self.request.remote_ip not in self.LOCAL:
+      raise HTTPError(403)
+
+    self.set_header('Content-Type', 'text/plain; version=0.0.4')
+    self.write(render())
@@ -0,0 +1,89 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import json
+
+from tornado.gen import Return, coroutine
+
+
+class OpLog(object):
+  """Append-only log of the operations applied to a scene.
+
+  Operations are stored in a redis sorted set, scored by their sequence
+  number. Whenever a client saves the scene, the data stored in the database
+  becomes the new snapshot and the operations it already contains are
+  discarded, so late joiners only need to replay what happened afterwards.
+  """
+
+  # Message types which modify the scene and must be replayed.
+  TYPES = ('create', 'edit', 'name')
+
+  # Maximum number of operations retained for a scene.
+  MAX_SIZE = 10000
+
+  def __init__(self, redis, scene_id):
+    """Creates a wrapper around the log of a scene."""
+
+    self.redis = redis
+    self.scene_id = scene_id
+    self.key = 'oplog:%s' % scene_id
+    self.meta = 'scene:%s' % scene_id
+
+  @coroutine
+  def append(self, data):
+    """Appends a sequenced message to the log if it modifies the scene."""
+
+    if data.get('type') not in self.TYPES:
+      return
+
+    yield self.redis.zadd(self.key, data['seq'], json.dumps(data))
+
+    # Drop the oldest entries if the log grew too large.
+    size = yield self.redis.zcard(self.key)
+    if size > self.MAX_SIZE:
+      index = size - self.MAX_SIZE - 1
+      ops = yield self.redis.zrange(self.key, index, index, False)
+      yield self.trim(json.loads(ops[0])['seq'])
+
+  @coroutine
+  def since(self, seq):
+    """Returns all operations after seq or None if some were discarded."""
+
+    base = yield self.redis.hget(self.meta, 'base')
+    if seq < int(base or 0):
+      raise Return(None)
+
+    ops = yield self.redis.zrangebyscore(self.key, '(%d' % seq, '+inf')
+    raise Return([json.loads(op) for op in ops])
+
+  @coroutine
+  def snapshot_seq(self):
+    """Returns the sequence number of the last stored snapshot."""
+
+    seq = yield self.redis.hget(self.meta, 'snapshot')
+    raise Return(int(seq or 0))
+
+  @coroutine
+  def snapshot(self, seq):
+    """Records that the stored scene contains all operations up to seq.
+
+    Operations are only discarded up to the older of the previous and the new
+    snapshot, since clients which loaded the previous one might still join.
+    """
+
+    last = yield self.redis.hget(self.meta, 'snapshot')
+    yield self.redis.hset(self.meta, 'snapshot', seq)
+    yield self.trim(min(seq, int(last)) if last is not None else 0)
+
+  @coroutine
+  def trim(self, seq):
+    """Discards all operations up to and including seq."""
+
+    if seq <= 0:
+      return
+
+    yield self.redis.zremrangebyscore(self.key, '-inf', seq)
+    base = yield self.redis.hget(self.meta, 'base')
+    if seq > int(base or 0):
+      yield self.redis.hset(self.meta, 'base', seq)
@@ -0,0 +1,158 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import collections
+
+from tornado.ioloop import IOLoop
+
+from shapy import metrics
+
+
+def merge(last, data):
+  """Merges two successive edits into one, returning None if impossible."""
+
+  if last.get('type') != 'edit' or data.get('type') != 'edit':
+    return None
+
+  # Edits must be performed by the same user on the same parts.
+  for key in ('tool', 'userId', 'objMode', 'ids', 'objId', 'uvIds'):
+    if last.get(key) != data.get(key):
+      return None
+
+  # The merged edit carries the sequence number of the latest one.
+  merged = dict(data)
+  tool = data['tool']
+  if tool == 'translate':
+    merged['dx'] = last['dx'] + data['dx']
+    merged['dy'] = last['dy'] + data['dy']
+    merged['dz'] = last['dz'] + data['dz']
+  elif tool == 'moveUV':
+    merged['du'] = last['du'] + data['du']
+    merged['dv'] = last['dv'] + data['dv']
+  elif tool in ('rotate', 'scale'):
+    # Transformations only compose around the same pivot.
+    for key in ('mx', 'my', 'mz'):
+      if last[key] != data[key]:
+        return None
+
+    if tool == 'scale':
+      merged['sx'] = last['sx'] * data['sx']
+      merged['sy'] = last['sy'] * data['sy']
+      merged['sz'] = last['sz'] * data['sz']
+    else:
+      # Rotating by the last quaternion, then the new one.
+      x1, y1, z1, w1 = last['x'], last['y'], last['z'], last['w']
+      x2, y2, z2, w2 = data['x'], data['y'], data['z'], data['w']
+      merged['x'] = w2 * x1 + x2 * w1 + y2 * z1 - z2 * y1
+      merged['y'] = w2 * y1 - x2 * z1 + y2 * w1 + z2 * x1
+      merged['z'] = w2 * z1 + x2 * y1 - y2 * x1 + z2 * w1
+      merged['w'] = w2 * w1 - x2 * x1 - y2 * y1 - z2 * z1
+  else:
+    return None
+
+  return merged
+
+
+
+class Outbox(object):
+  """Bounded queue of messages waiting to be sent over a websocket.
+
+  Messages are written straight to the connection while it keeps up. While
+  the stream is still busy writing earlier data, messages are queued instead
+  and successive edits are merged. If the queue still overflows, it is
+  discarded and the connection is closed, asking the client to reconnect &
+  replay the operation log.
+  """
+
+  # Number of queued messages after which the client is resynced.
+  MAX_SIZE = 256
+
+  # Interval between attempts to flush a congested connection, in seconds.
+  FLUSH_INTERVAL = 0.05
+
+  # Counters shared by all connections in the process.
+  coalesced = 0
+  dropped = 0
+  resyncs = 0
+
+  def __init__(self, handler):
+    """Creates an outbox for a websocket handler."""
+
+    self.handler = handler
+    self.queue = collections.deque()
+    self.timeout = None
+    self.stalled = False
+
+  @property
+  def depth(self):
+    """Returns the number of messages waiting to be sent."""
+
+    return len(self.queue)
+
+  def push(self, packet):
+    """Sends a channel packet or queues it if the client is slow."""
+
+    if self.stalled:
+      Outbox.dropped += 1
+      return
+
+    if not self.queue and not self.handler.stream.writing():
+      payload, binary = packet.encode(self.handler.protocol)
+      self.handler.write_message(payload, binary=binary)
+      metrics.DELIVERED.inc()
+      return
+
+    # Try to merge the message with the last queued one.
+    data = packet.data
+    merged = merge(self.queue[-1], data) if self.queue else None
+    if merged is not None:
+      self.queue[-1] = merged
+      Outbox.coalesced += 1
+    else:
+      self.queue.append(data)
+
+    if len(self.queue) > self.MAX_SIZE:
+      self.resync()
+    elif self.timeout is None:
+      self.timeout = IOLoop.current().add_timeout(
+          IOLoop.current().time() + self.FLUSH_INTERVAL, self.flush)
+
+  def flush(self):
+    """Writes out the queued messages once the stream drained."""
+
+    self.timeout = None
+    if self.handler.stream.closed():
+      self.queue.clear()
+      return
+
+    if self.handler.stream.writing():
+      self.timeout = IOLoop.current().add_timeout(
+          IOLoop.current().time() + self.FLUSH_INTERVAL, self.flush)
+      return
+
+    while self.queue:
+      self.handler.send(self.queue.popleft())
+      metrics.DELIVERED.inc()
+
+  def resync(self):
+    """Discards all queued messages and asks the client to resynchronise.
+
+    The connection is closed once the request is written out, so the client
+    cannot keep on missing messages if it does not reconnect by itself.
+    """
+
+    Outbox.dropped += len(self.queue)
+    Outbox.resyncs += 1
+    self.queue.clear()
+    self.stalled = True
+    self.handler.send({ 'type': 'resync' })
+    self.handler.close()
+
+  def close(self):
+    """Stops flushing messages."""
+
+    if self.timeout is not None:
+      IOLoop.current().remove_timeout(self.timeout)
+      self.timeout = None
+    self.queue.clear()
@@ -118,31 +118,36 @@ class PermissionsHandler(APIHandler):
         raise HTTPError(400, 'Permissions setting failed.')
       ownerEmail = data[0]
 
-    # Delete previous permissions
-    cursor = yield momoko.Op(self.db.execute,
-      '''DELETE
-         FROM permissions
-         WHERE asset_id = %s
-      ''', (
-      id,
-    ))
+    # Invalidate cached grants even if some of the new ones are rejected,
+    # since the previous ones are deleted by then.
+    try:
+      # Delete previous permissions
+      cursor = yield momoko.Op(self.db.execute,
+        '''DELETE
+           FROM permissions
+           WHERE asset_id = %s
+        ''', (
+        id,
+      ))
 
-    # Insert new permissions if needed
-    if len(permissions) > 0:
-      permissions.append((ownerEmail, True))
-      queries = []
-      for perm in permissions:
-        queries.append((
-          '''INSERT INTO permissions (asset_id, user_id, write)
-             SELECT %s AS asset_id, id, %s AS write
-             FROM users
-             WHERE email = %s
-             RETURNING user_id
-          ''',(id, perm[1], perm[0])))
-      cursors = yield momoko.Op(self.db.transaction, tuple(queries))
-      for x in range(len(permissions)):
-        data = cursors[x].fetchone()
-        if not data:
-          raise HTTPError(400, 'Permissions setting failed.')
+      # Insert new permissions if needed
+      if len(permissions) > 0:
+        permissions.append((ownerEmail, True))
+        queries = []
+        for perm in permissions:
+          queries.append((
+            '''INSERT INTO permissions (asset_id, user_id, write)
+               SELECT %s AS asset_id, id, %s AS write
+               FROM users
+               WHERE email = %s
+               RETURNING user_id
+            ''',(id, perm[1], perm[0])))
+        cursors = yield momoko.Op(self.db.transaction, tuple(queries))
+        for x in range(len(permissions)):
+          data = cursors[x].fetchone()
+          if not data:
+            raise HTTPError(400, 'Permissions setting failed.')
+    finally:
+      yield self.acl.invalidate(id)
 
     self.finish();
@@ -0,0 +1,214 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import datetime
+import functools
+import hashlib
+import time
+
+import concurrent.futures
+import momoko
+import tornadoredis
+from tornado.gen import Return, Task, TimeoutError, coroutine, with_timeout
+from tornado.ioloop import IOLoop
+from tornadoredis.exceptions import ResponseError
+
+from shapy import metrics
+
+
+class Script(object):
+  """Lua script executed by hash, loaded into redis on first use."""
+
+  def __init__(self, pool, source):
+    """Creates a script bound to a pool."""
+
+    self.pool = pool
+    self.source = source
+    self.sha = hashlib.sha1(source).hexdigest()
+
+  @coroutine
+  def __call__(self, keys=[], args=[]):
+    """Runs the script, returning its result."""
+
+    try:
+      result = yield self.pool.evalsha(self.sha, keys, args)
+    except ResponseError as e:
+      if not str(e).startswith('NOSCRIPT'):
+        raise
+      result = yield self.pool.eval(self.source, keys, args)
+
+    raise Return(result)
+
+
+
+class RedisPool(object):
+  """Non-blocking access to redis through a bounded pool of connections.
+
+  Any tornadoredis command can be invoked on the pool as a coroutine, such as
+  `value = yield pool.get(key)`. Every command borrows a connection for its
+  duration and fails with a TimeoutError if no reply arrives in time.
+  """
+
+  def __init__(self, host, port, password, size=16, timeout=2.0):
+    """Creates a pool of connections to a redis server."""
+
+    self.password = password or None
+    self.timeout = datetime.timedelta(seconds=timeout)
+    self.pool = tornadoredis.ConnectionPool(
+        max_connections=size,
+        wait_for_available=True,
+        host=host,
+        port=port)
+
+  def __getattr__(self, command):
+    """Returns a coroutine running a redis command."""
+
+    return functools.partial(self.execute, command)
+
+  def register_script(self, source):
+    """Returns a callable running a Lua script."""
+
+    return Script(self, source)
+
+  @coroutine
+  def execute(self, command, *args, **kwargs):
+    """Runs a command on a pooled connection, returning the reply."""
+
+    client = tornadoredis.Client(
+        connection_pool=self.pool,
+        password=self.password)
+    start = time.time()
+    try:
+      result = yield with_timeout(
+          self.timeout,
+          Task(getattr(client, command), *args, **kwargs),
+          quiet_exceptions=tornadoredis.ConnectionError)
+    except TimeoutError:
+      # The reply might still arrive, so the connection cannot be reused.
+      self.discard_(client)
+      raise
+    finally:
+      client.disconnect()
+      metrics.REDIS.observe(time.time() - start, command=command)
+
+    if isinstance(result, Exception):
+      raise result
+    raise Return(result)
+
+  def discard_(self, client):
+    """Closes the connection of a client & replaces it in the pool.
+
+    Clients still waiting for a connection hold a proxy, which is released as
+    usual. tornadoredis cannot drop connections, so the client is detached
+    from the pool, which would take the connection back, & the pool is
+    updated here.
+    """
+
+    connection = client.connection
+    if not isinstance(connection, tornadoredis.Connection):
+      return
+
+    connection.disconnect()
+    client._connection_pool = None
+    self.pool._in_use_connections.discard(connection)
+    self.pool._created_connections -= 1
+
+    # Hand a new connection to clients waiting for one.
+    replacement = self.pool.make_connection()
+    if replacement is not None:
+      self.pool.release(replacement)
+
+
+
+class DatabasePool(momoko.Pool):
+  """Pool of database connections recording the latency of queries."""
+
+  def execute(self, *args, **kwargs):
+    """Runs a query."""
+
+    return super(DatabasePool, self).execute(
+        *args, **self.timed_('execute', kwargs))
+
+  def transaction(self, *args, **kwargs):
+    """Runs several queries in a transaction."""
+
+    return super(DatabasePool, self).transaction(
+        *args, **self.timed_('transaction', kwargs))
+
+  def timed_(self, kind, kwargs):
+    """Wraps the callback of a query to measure its latency."""
+
+    start = time.time()
+    callback = kwargs.get('callback')
+
+    def done(*args, **kwargs):
+      metrics.DATABASE.observe(time.time() - start, kind=kind)
+      if callback:
+        callback(*args, **kwargs)
+
+    return dict(kwargs, callback=done)
+
+
+
+class PoolFull(Exception):
+  """Raised when too many jobs are waiting for the process pool."""
+
+
+
+class ProcessPool(object):
+  """Runs CPU intensive jobs, such as image processing, in other processes.
+
+  Jobs are run as coroutines, such as `result = yield pool.run(func, arg)`.
+  At most max_pending jobs are queued or running at once, further ones being
+  refused with PoolFull, and waiting for a job fails with a TimeoutError.
+  Running jobs cannot be interrupted, so they hold their slot until done.
+  """
+
+  def __init__(self, size=2, max_pending=16, timeout=30.0):
+    """Starts the processes of the pool."""
+
+    self.executor = concurrent.futures.ProcessPoolExecutor(size)
+    self.max_pending = max_pending
+    self.timeout = timeout
+    self.pending = 0
+
+  @coroutine
+  def run(self, func, *args, **kwargs):
+    """Runs a function in a process, returning its result.
+
+    The timeout of the pool, in seconds, can be overridden with `timeout`.
+    """
+
+    timeout = kwargs.pop('timeout', self.timeout)
+    if self.pending >= self.max_pending:
+      metrics.JOBS_REJECTED.inc(job=func.__name__)
+      raise PoolFull('Too many pending jobs')
+
+    # Futures complete on a thread of the executor, not on the IOLoop.
+    io_loop = IOLoop.current()
+    start = time.time()
+    future = self.executor.submit(func, *args, **kwargs)
+    self.pending += 1
+    metrics.JOBS_PENDING.set(self.pending)
+    future.add_done_callback(lambda _: io_loop.add_callback(
+        self.done_, func.__name__, start))
+
+    try:
+      result = yield with_timeout(
+          datetime.timedelta(seconds=timeout),
+          future,
+          quiet_exceptions=concurrent.futures.CancelledError)
+    except TimeoutError:
+      # Only jobs which have not started yet can be cancelled.
+      future.cancel()
+      raise
+
+    raise Return(result)
+
+  def done_(self, job, start):
+    """Frees the slot of a finished job."""
+
+    self.pending -= 1
+    metrics.JOBS_PENDING.set(self.pending)
+    metrics.JOBS.observe(time.time() - start, job=job)
@@ -0,0 +1,68 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import json
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+
+# WebSocket subprotocols understood by the editor.
+JSON = 'shapy.json'
+MSGPACK = 'shapy.msgpack'
+
+
+def supported():
+  """Returns the available protocols, in order of preference."""
+
+  return [MSGPACK, JSON] if msgpack else [JSON]
+
+
+def encode(protocol, data):
+  """Serializes a message, returning the payload and the binary flag."""
+
+  if protocol == MSGPACK:
+    return msgpack.packb(data, use_bin_type=False), True
+  return json.dumps(data), False
+
+
+def decode(protocol, message):
+  """Deserializes a message received from a client."""
+
+  if protocol == MSGPACK and isinstance(message, str):
+    return msgpack.unpackb(message, encoding='utf-8')
+  return json.loads(message)
+
+
+
+class Packet(object):
+  """Message received from a channel, serialized at most once per protocol.
+
+  All sockets in a process share the packet, so a message fanned out to
+  hundreds of viewers is only decoded and re-encoded once.
+  """
+
+  def __init__(self, body):
+    """Wraps the JSON body of a channel message."""
+
+    self.body = body
+    self.data_ = None
+    self.frames = { JSON: (body, False) }
+
+  @property
+  def data(self):
+    """Returns the decoded message. It must not be modified."""
+
+    if self.data_ is None:
+      self.data_ = json.loads(self.body)
+    return self.data_
+
+  def encode(self, protocol):
+    """Returns the payload and the binary flag for a protocol."""
+
+    if protocol not in self.frames:
+      self.frames[protocol] = encode(protocol, self.data)
+    return self.frames[protocol]
@@ -0,0 +1,190 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import base64
+import cStringIO
+import hashlib
+import json
+
+import momoko
+import numpy as np
+import psycopg2
+from PIL import Image
+from tornado.gen import coroutine
+from tornado.log import app_log
+
+from shapy.scene import Scene
+
+
+# Size of previews, matching those made by the browser.
+PREVIEW_WIDTH = 147
+PREVIEW_HEIGHT = 105
+
+# Previews are rendered larger, then scaled down to smooth edges.
+SUPERSAMPLE = 2
+
+# Maximum number of pixels tested against triangles at once.
+MAX_FRAGMENTS = 1 << 21
+
+# Tolerance of the tests of pixels, closing cracks between triangles.
+EPSILON = 1e-6
+
+# Direction the camera looks at scenes in.
+VIEW = np.array([-1.0, -0.8, -1.2]) / np.sqrt(1.0 + 0.64 + 1.44)
+
+# Colours of the background & of objects, like in the editor.
+BACKGROUND = np.array([0.9, 0.9, 0.9])
+COLOUR = np.array([0.55, 0.65, 0.85])
+
+
+def project(facets, width, height):
+  """Projects the corners of facets to pixels, fitting them in the image.
+
+  Returns the x, y & depth of the corners, as (faces, 3) arrays.
+  """
+
+  right = np.cross(VIEW, [0.0, 1.0, 0.0])
+  right /= np.sqrt(right.dot(right))
+  up = np.cross(right, VIEW)
+
+  corners = facets[:, 3:].reshape(-1, 3)
+  x, y, z = corners.dot(right), corners.dot(up), corners.dot(VIEW)
+
+  # Scale orthographically, leaving a margin of a tenth of the image.
+  size = max((x.max() - x.min()) / width, (y.max() - y.min()) / height)
+  scale = 0.9 / max(size, 1e-9)
+  x = (x - (x.max() + x.min()) / 2) * scale + width / 2.0
+  y = height / 2.0 - (y - (y.max() + y.min()) / 2) * scale
+  return x.reshape(-1, 3), y.reshape(-1, 3), z.reshape(-1, 3)
+
+
+def rasterize(x, y, z, shades, width, height):
+  """Draws shaded triangles with a depth buffer.
+
+  Pixels covered by triangles are expanded from their bounding boxes, in
+  batches of at most MAX_FRAGMENTS pixels, and tested all at once.
+  Returns the shade of every pixel, NaN where there is no triangle.
+  """
+
+  depth = np.full(width * height, np.inf)
+  image = np.full(width * height, np.nan)
+
+  # Pixels whose centres lie in the bounding boxes of triangles.
+  x0 = np.clip(np.ceil(x.min(axis=1) - 0.5), 0, width).astype(np.int64)
+  x1 = np.clip(np.floor(x.max(axis=1) - 0.5), -1, width - 1).astype(np.int64)
+  y0 = np.clip(np.ceil(y.min(axis=1) - 0.5), 0, height).astype(np.int64)
+  y1 = np.clip(np.floor(y.max(axis=1) - 0.5), -1, height - 1).astype(np.int64)
+  w = np.maximum(x1 - x0 + 1, 0)
+  h = np.maximum(y1 - y0 + 1, 0)
+
+  # Triangles seen edge-on or smaller than a pixel are skipped.
+  area = ((y[:, 1] - y[:, 2]) * (x[:, 0] - x[:, 2]) +
+          (x[:, 2] - x[:, 1]) * (y[:, 0] - y[:, 2]))
+  keep = (w * h > 0) & (area != 0)
+  x, y, z, shades = x[keep], y[keep], z[keep], shades[keep]
+  x0, y0, w, h, area = x0[keep], y0[keep], w[keep], h[keep], area[keep]
+
+  counts = w * h
+  ends = np.cumsum(counts)
+  start = 0
+  while start < len(counts):
+    base = ends[start - 1] if start else 0
+    end = max(np.searchsorted(ends, base + MAX_FRAGMENTS, 'right'), start + 1)
+
+    # Enumerate the pixels of the bounding boxes of the batch.
+    tris = np.repeat(np.arange(start, end), counts[start:end])
+    offsets = np.arange(len(tris)) - (ends[tris] - counts[tris] - base)
+    px = x0[tris] + offsets % w[tris]
+    py = y0[tris] + offsets // w[tris]
+    cx, cy = px + 0.5, py + 0.5
+
+    # Keep those inside the triangles, interpolating their depth.
+    tx, ty = x[tris], y[tris]
+    l0 = ((ty[:, 1] - ty[:, 2]) * (cx - tx[:, 2]) +
+          (tx[:, 2] - tx[:, 1]) * (cy - ty[:, 2])) / area[tris]
+    l1 = ((ty[:, 2] - ty[:, 0]) * (cx - tx[:, 2]) +
+          (tx[:, 0] - tx[:, 2]) * (cy - ty[:, 2])) / area[tris]
+    l2 = 1 - l0 - l1
+    inside = (l0 >= -EPSILON) & (l1 >= -EPSILON) & (l2 >= -EPSILON)
+    tris, l0, l1, l2 = tris[inside], l0[inside], l1[inside], l2[inside]
+    pixels = (py * width + px)[inside]
+    depths = l0 * z[tris, 0] + l1 * z[tris, 1] + l2 * z[tris, 2]
+
+    # Keep the nearest fragment of every pixel, if nearer than the buffer.
+    order = np.lexsort((depths, pixels))
+    pixels, first = np.unique(pixels[order], return_index=True)
+    nearest = order[first]
+    closer = depths[nearest] < depth[pixels]
+    pixels, nearest = pixels[closer], nearest[closer]
+    depth[pixels] = depths[nearest]
+    image[pixels] = shades[tris[nearest]]
+
+    start = end
+
+  return image.reshape(height, width)
+
+
+def render(scene, width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT):
+  """Renders the objects of a scene with flat shading into an image."""
+
+  facets = [obj.facets() for obj in scene.objects.itervalues()]
+  facets = np.concatenate(facets or [np.zeros((0, 12))])
+  facets = facets[np.isfinite(facets[:, 3:]).all(axis=1)]
+
+  size = (width * SUPERSAMPLE, height * SUPERSAMPLE)
+  pixels = np.empty((size[1], size[0], 3))
+  pixels[:] = BACKGROUND
+  if len(facets):
+    # Faces are lit from behind the camera, on both sides.
+    light = -VIEW + [0.0, 0.5, 0.0]
+    light /= np.sqrt(light.dot(light))
+    shades = 0.35 + 0.65 * np.abs(np.nan_to_num(facets[:, :3]).dot(light))
+
+    x, y, z = project(facets, *size)
+    shades = rasterize(x, y, z, shades, *size)
+    covered = ~np.isnan(shades)
+    pixels[covered] = shades[covered][:, None] * COLOUR
+
+  image = Image.fromarray((pixels * 255).round().astype(np.uint8), 'RGB')
+  return image.resize((width, height), Image.ANTIALIAS)
+
+
+def preview(data):
+  """Renders the preview of a scene, given as JSON, into a JPEG data URL.
+
+  This is slow for large scenes, so it is meant to run in a process pool.
+  """
+
+  scene = Scene(None, json.loads(data or 'null') or { 'objects': {} })
+  stream = cStringIO.StringIO()
+  render(scene).save(stream, format='JPEG')
+  return 'data:image/jpeg;base64,%s' % base64.b64encode(stream.getvalue())
+
+
+@coroutine
+def update_preview(app, id, data):
+  """Renders the preview of a scene in the process pool & stores it.
+
+  The preview is only stored if the scene was not saved again meanwhile, so
+  a slow render cannot replace the preview of newer data.
+  """
+
+  # Scenes uploaded by clients arrive as unicode.
+  if isinstance(data, unicode):
+    data = data.encode('utf-8')
+
+  try:
+    image = yield app.executor.run(preview, data)
+    yield momoko.Op(app.db.execute,
+      '''UPDATE assets
+         SET preview = %(preview)s::bytea
+         WHERE id = %(id)s
+           AND md5(data) = %(md5)s
+      ''', {
+      'id': id,
+      'preview': psycopg2.Binary(image),
+      'md5': hashlib.md5(data or '').hexdigest()
+    })
+  except Exception:
+    app_log.exception('Cannot render preview of scene %s', id)
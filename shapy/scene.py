@@ -2,8 +2,209 @@
 # Licensing information can be found in the LICENSE file.
 # (C) 2015 The Shapy Team. All rights reserved.
 
-import StringIO
-from pyrr.objects import Quaternion, Matrix44, Vector3, Vector4
+import itertools
+import json
+import struct
+
+import numpy as np
+from pyrr.objects import Quaternion, Matrix44
+
+
+def quat_mul(a, b):
+  """Multiplies two (x, y, z, w) quaternions."""
+
+  ax, ay, az, aw = a
+  bx, by, bz, bw = b
+  return (
+    aw * bx + ax * bw + ay * bz - az * by,
+    aw * by - ax * bz + ay * bw + az * bx,
+    aw * bz + ax * by - ay * bx + az * bw,
+    aw * bw - ax * bx - ay * by - az * bz
+  )
+
+
+def quat_rotate(q, v):
+  """Rotates a vector by a quaternion."""
+
+  x, y, z, _ = quat_mul(quat_mul(q, (v[0], v[1], v[2], 0.0)),
+                        (-q[0], -q[1], -q[2], q[3]))
+  return np.array([x, y, z])
+
+
+def quat_matrix(q):
+  """Converts a quaternion to a 3x3 rotation matrix."""
+
+  x, y, z, w = q
+  return np.array([
+    [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+    [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+    [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]
+  ])
+
+
+def lookup(ids, keys):
+  """Returns the indices of keys in an array of IDs, like a dict lookup."""
+
+  keys = np.asarray(keys, dtype=np.int64)
+  if not keys.size:
+    return np.zeros(keys.shape, dtype=np.int64)
+  if not len(ids):
+    raise KeyError('Unknown ID')
+
+  # IDs are allocated sequentially by the editor, so a table is usually small.
+  if ids.min() >= 0 and ids.max() < 4 * len(ids) + 1024:
+    if keys.min() < 0 or keys.max() > ids.max():
+      raise KeyError('Unknown ID')
+    table = np.full(ids.max() + 1, -1, dtype=np.int64)
+    table[ids] = np.arange(len(ids))
+    rows = table[keys]
+    if np.any(rows < 0):
+      raise KeyError('Unknown ID')
+    return rows
+
+  order = np.argsort(ids)
+  rows = order[np.minimum(np.searchsorted(ids[order], keys), len(ids) - 1)]
+  if np.any(ids[rows] != keys):
+    raise KeyError('Unknown ID')
+  return rows
+
+
+def format_rows(template, rows):
+  """Formats the rows of an array with a template, a few at a time."""
+
+  for start in xrange(0, len(rows), CHUNK_ROWS):
+    chunk = rows[start:start + CHUNK_ROWS]
+    yield template * len(chunk) % tuple(chunk.ravel().tolist())
+
+
+# Number of rows formatted at once by streamed exports.
+CHUNK_ROWS = 4096
+
+# Triangle of a binary STL file: normal, corners & attributes.
+STLB_TRIANGLE = np.dtype([('data', '<f4', (12,)), ('attributes', '<u2')])
+
+# glTF component types of numpy arrays.
+GLTF_COMPONENTS = { '<f4': 5126, '<u4': 5125 }
+
+# Facet of an STL file, holding the normal & the corners of a face.
+STL_FACET = (
+  'facet normal %f %f %f\n'
+  'outer loop\n'
+  'vertex %f %f %f\n'
+  'vertex %f %f %f\n'
+  'vertex %f %f %f\n'
+  'end loop\n'
+)
+
+
+class Table(object):
+  """Map of integer IDs to rows of numbers, stored in contiguous arrays.
+
+  Rows are sorted by ID. Reading & updating rows is cheap, while inserting &
+  deleting them copies the arrays. Rows are read back as tuples, like the
+  dicts the scene used to be made of.
+  """
+
+  __slots__ = ('ids', 'values')
+
+  def __init__(self, ids, values):
+    """Creates a table from an array of IDs & one of rows."""
+
+    order = np.argsort(ids, kind='mergesort')
+    self.ids = ids[order]
+    self.values = values[order]
+
+  @classmethod
+  def from_json(cls, data, width, dtype):
+    """Creates a table from a map of string IDs to lists, as sent by editors."""
+
+    data = data or {}
+    rows = data.values()
+    if set(map(len, rows)) - set([width]):
+      rows = [row[:width] for row in rows]
+
+    # Parsing the keys at once is much faster than calling int on each one.
+    ids = np.fromstring(' '.join(data.iterkeys()), dtype=np.int64, sep=' ')
+    if len(ids) != len(data):
+      ids = np.fromiter(
+          itertools.imap(int, data.iterkeys()), dtype=np.int64, count=len(data))
+    values = np.fromiter(
+        itertools.chain.from_iterable(rows),
+        dtype=dtype,
+        count=len(rows) * width)
+    return cls(ids, values.reshape(-1, width))
+
+  def row_(self, id):
+    """Returns the index of the row of an ID or None."""
+
+    row = np.searchsorted(self.ids, id)
+    if row < len(self.ids) and self.ids[row] == id:
+      return row
+    return None
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, id):
+    return self.row_(id) is not None
+
+  def __iter__(self):
+    return iter(self.ids.tolist())
+
+  def __getitem__(self, id):
+    row = self.row_(id)
+    if row is None:
+      raise KeyError(id)
+    return tuple(self.values[row].tolist())
+
+  def __setitem__(self, id, value):
+    row = np.searchsorted(self.ids, id)
+    if row < len(self.ids) and self.ids[row] == id:
+      self.values[row] = value
+    else:
+      self.ids = np.insert(self.ids, row, id)
+      self.values = np.insert(self.values, row, value, axis=0)
+
+  def pop(self, id, *default):
+    """Removes a row, returning it or the default if it does not exist."""
+
+    row = self.row_(id)
+    if row is None:
+      if default:
+        return default[0]
+      raise KeyError(id)
+
+    value = tuple(self.values[row].tolist())
+    self.ids = np.delete(self.ids, row)
+    self.values = np.delete(self.values, row, axis=0)
+    return value
+
+  def keep(self, mask):
+    """Removes the rows not selected by a boolean mask."""
+
+    self.ids = self.ids[mask]
+    self.values = self.values[mask]
+
+  def iterkeys(self):
+    return iter(self.ids.tolist())
+
+  def itervalues(self):
+    return itertools.imap(tuple, self.values.tolist())
+
+  def iteritems(self):
+    return itertools.izip(self.ids.tolist(), self.itervalues())
+
+  def to_json(self, truncate=False):
+    """Converts the table to a map of IDs to lists.
+
+    If requested, coordinates are truncated to 3 decimals like the editor does.
+    """
+
+    values = self.values
+    if truncate:
+      values = np.floor(values * 1000) / 1000
+    return dict(itertools.izip(self.ids.tolist(), values.tolist()))
+
 
 
 class Scene(object):
@@ -12,12 +213,22 @@ class Scene(object):
   class Object(object):
     """Class representing an object in a scene."""
 
+    __slots__ = (
+      'id', 'texture',
+      'tx', 'ty', 'tz', 'sx', 'sy', 'sz', 'rx', 'ry', 'rz', 'rw',
+      'verts', 'edges', 'uvPoints', 'uvEdges', 'faces',
+      'model', 'rotation', 'linear'
+    )
+
     def __init__(self, data={}):
       """Initializes an empty object."""
 
       # Name of the object.
       self.id = data.get('id', 'unnamed')
 
+      # ID of the texture applied to the object.
+      self.texture = data.get('texture')
+
       # Translation vector.
       self.tx = data.get('tx', 0.0)
       self.ty = data.get('ty', 0.0)
@@ -34,38 +245,27 @@ class Scene(object):
       self.rz = data.get('rz', 0.0)
       self.rw = data.get('rw', 0.0)
 
-      # Map of vertices.
-      self.verts = dict(
-        (int(k), (v[0], v[1], v[2]))
-        for k, v in (data['verts'] or {}).iteritems()
-      )
-
-      # Map of edges.
-      self.edges = dict(
-        (int(k), (v[0], v[1]))
-        for k, v in (data['edges'] or {}).iteritems()
-      )
-
-      # Map of UV points.
-      self.uvPoints = dict(
-        (int(k), (v[0], v[1]))
-        for k, v in (data['uvPoints'] or {}).iteritems()
-      )
-
-      # Map of UV edges.
-      self.uvEdges = dict(
-        (int(k), (v[0], v[1]))
-        for k, v in (data['uvEdges'] or {}).iteritems()
-      )
-
-      # Map of faces.
-      self.faces = dict(
-        (int(k), (v[0], v[1], v[2], v[3], v[4], v[5]))
-        for k, v in (data['faces'] or {}).iteritems()
-
-      )
+      # Table of vertices.
+      self.verts = Table.from_json(data['verts'], 3, np.float64)
+
+      # Table of edges.
+      self.edges = Table.from_json(data['edges'], 2, np.int64)
+
+      # Table of UV points.
+      self.uvPoints = Table.from_json(data['uvPoints'], 2, np.float64)
+
+      # Table of UV edges.
+      self.uvEdges = Table.from_json(data['uvEdges'], 2, np.int64)
+
+      # Table of faces.
+      self.faces = Table.from_json(data['faces'], 6, np.int64)
 
       # Model matrix.
+      self.update_model()
+
+    def update_model(self):
+      """Recomputes the model matrix after the transformation changed."""
+
       q = Quaternion()
       q.x = self.rx
       q.y = self.ry
@@ -80,6 +280,168 @@ class Scene(object):
       ])
       self.model = trans * q * scale
 
+      # Rotation & scaling, applied to vertices in the editor.
+      self.rotation = quat_matrix((self.rx, self.ry, self.rz, self.rw))
+      self.linear = self.rotation.dot(np.diag([self.sx, self.sy, self.sz]))
+
+    def transform(self, points):
+      """Applies the model matrix to an array of points."""
+
+      m = np.asarray(self.model)
+      return (points[:, 0:1] * m[0, :3] + points[:, 1:2] * m[1, :3] +
+              points[:, 2:3] * m[2, :3] + m[3, :3])
+
+    def face_verts(self):
+      """Returns the IDs of the vertices at the corners of all faces."""
+
+      return self.corners_(self.edges, slice(0, 3))
+
+    def face_uvs(self):
+      """Returns the IDs of the UV points at the corners of all faces."""
+
+      return self.corners_(self.uvEdges, slice(3, 6))
+
+    def corners_(self, edges, columns):
+      """Resolves the signed edges of faces to the points they start at."""
+
+      faces = self.faces.values[:, columns]
+      rows = lookup(edges.ids, np.abs(faces))
+      return np.where(faces >= 0, edges.values[rows, 0], edges.values[rows, 1])
+
+    def facets(self):
+      """Returns the normal & the transformed corners of every face.
+
+      Each row of the (faces, 12) array holds the normal and the 3 corners.
+      """
+
+      corners = self.transform(self.verts.values)[
+          lookup(self.verts.ids, self.face_verts())]
+      v0, v1, v2 = corners[:, 0], corners[:, 1], corners[:, 2]
+      with np.errstate(invalid='ignore', divide='ignore'):
+        n = np.cross(v1 - v0, v2 - v0)
+        n = n / np.sqrt((n * n).sum(axis=1))[:, None]
+
+      return np.hstack((n, v0, v1, v2))
+
+    def buffers(self):
+      """Returns indexed vertex attributes, as uploaded to WebGL.
+
+      Vertices are the distinct (position, UV point) pairs of face corners,
+      in object space, with normals averaged over the faces sharing them.
+      """
+
+      verts = self.verts.values
+      uvs = self.uvPoints.values
+      vert_rows = lookup(self.verts.ids, self.face_verts())
+      uv_rows = lookup(self.uvPoints.ids, self.face_uvs())
+
+      # Number the distinct pairs of corners.
+      stride = max(len(uvs), 1)
+      keys, indices = np.unique(
+          (vert_rows * stride + uv_rows).ravel(), return_inverse=True)
+      positions = verts[keys // stride]
+      indices = indices.reshape(-1, 3)
+
+      # Sum face normals, weighted by area, into the vertices.
+      corners = verts[vert_rows]
+      face_normals = np.cross(
+          corners[:, 1] - corners[:, 0],
+          corners[:, 2] - corners[:, 0])
+      normals = np.zeros(positions.shape)
+      for i in range(3):
+        np.add.at(normals, indices[:, i], face_normals)
+      with np.errstate(invalid='ignore', divide='ignore'):
+        normals /= np.sqrt((normals * normals).sum(axis=1))[:, None]
+
+      return {
+        'positions': positions.astype('<f4'),
+        'normals': np.nan_to_num(normals).astype('<f4'),
+        'uvs': uvs[keys % stride].astype('<f4'),
+        'indices': indices.astype('<u4').ravel()
+      }
+
+    def get_position(self):
+      """Returns the position of the object."""
+
+      return np.array([self.tx, self.ty, self.tz])
+
+    def translate(self, dx, dy, dz):
+      """Translates the object."""
+
+      self.tx += dx
+      self.ty += dy
+      self.tz += dz
+      self.update_model()
+
+    def rotate(self, q):
+      """Rotates the object by a quaternion."""
+
+      self.rx, self.ry, self.rz, self.rw = quat_mul(
+          q, (self.rx, self.ry, self.rz, self.rw))
+      self.update_model()
+
+    def scale(self, x, y, z):
+      """Scales the object along world axes."""
+
+      t = np.linalg.inv(self.rotation).dot([x - 1, y - 1, z - 1])
+      self.sx *= 1 + t[0]
+      self.sy *= 1 + t[1]
+      self.sz *= 1 + t[2]
+      self.update_model()
+
+    def get_vertex(self, id):
+      """Returns the position of a vertex, rotated & scaled."""
+
+      return self.linear.dot(self.verts[id])
+
+    def translate_vertex(self, id, d):
+      """Translates a vertex by a rotated & scaled delta."""
+
+      p = np.linalg.solve(self.linear, self.get_vertex(id) + d)
+      self.verts[id] = (p[0], p[1], p[2])
+
+    def delete_vertex(self, id):
+      """Deletes a vertex along with the edges & faces using it."""
+
+      self.verts.pop(id, None)
+      self.edges.keep(
+          np.in1d(self.edges.values, self.verts.ids).reshape(-1, 2).all(axis=1))
+      self.delete_faces_()
+
+    def delete_edge(self, id):
+      """Deletes an edge along with the faces using it."""
+
+      self.edges.pop(id, None)
+      self.delete_faces_()
+
+    def delete_face(self, id):
+      """Deletes a face."""
+
+      self.faces.pop(id, None)
+
+    def delete_faces_(self):
+      """Deletes faces which lost an edge."""
+
+      edges = np.abs(self.faces.values[:, :3])
+      self.faces.keep(
+          np.in1d(edges, self.edges.ids).reshape(-1, 3).all(axis=1))
+
+    def to_json(self):
+      """Converts the object to the format used by the editor."""
+
+      return {
+        'id': self.id,
+        'tx': self.tx, 'ty': self.ty, 'tz': self.tz,
+        'sx': self.sx, 'sy': self.sy, 'sz': self.sz,
+        'rx': self.rx, 'ry': self.ry, 'rz': self.rz, 'rw': self.rw,
+        'texture': self.texture,
+        'verts': self.verts.to_json(truncate=True),
+        'edges': self.edges.to_json(),
+        'faces': self.faces.to_json(),
+        'uvPoints': self.uvPoints.to_json(truncate=True),
+        'uvEdges': self.uvEdges.to_json()
+      }
+
 
     @property
     def __dict__(self):
@@ -92,12 +454,114 @@ class Scene(object):
       }
 
 
+  # Edits which can be applied on the server. Others, such as extrusions, are
+  # only implemented by the editor, which has to upload the whole scene.
+  TOOLS = (
+    'translate', 'rotate', 'scale', 'delete', 'moveUV', 'texture', 'paint'
+  )
+
   def __init__(self, name, data={}):
     """Initializes an empty scene."""
 
+    self.id = data.get('id')
+    self.seq = data.get('seq', 0)
     self.objects = dict(
       (k, Scene.Object(v)) for k, v in (data['objects'] or {}).iteritems())
 
+  def to_json(self):
+    """Converts the scene to the format used by the editor."""
+
+    return {
+      'id': self.id,
+      'seq': self.seq,
+      'objects': dict((k, v.to_json()) for k, v in self.objects.iteritems())
+    }
+
+  def apply(self, data):
+    """Applies an edit message, returning False if it is not supported."""
+
+    tool = data.get('tool')
+    if data.get('type') != 'edit' or tool not in self.TOOLS:
+      return False
+    if tool == 'paint':
+      # Painting changes textures, which are stored separately.
+      return True
+    if tool == 'delete' and not data['objMode']:
+      self.delete_parts_(data['ids'])
+      return True
+    if tool in ('moveUV', 'texture'):
+      obj = self.objects.get(data['objId'])
+      if obj is None:
+        return True
+      if tool == 'texture':
+        obj.texture = data['textureId']
+        return True
+      for id in data['uvIds']:
+        u, v = obj.uvPoints[int(id)]
+        obj.uvPoints[int(id)] = (u + data['du'], v + data['dv'])
+      return True
+
+    # Objects are transformed as a whole, parts vertex by vertex.
+    if data['objMode']:
+      targets = [
+        (self.objects[id], None)
+        for id in data['ids'] if id in self.objects
+      ]
+    else:
+      targets = [
+        (self.objects[id], int(vert))
+        for id, vert in data['ids'] if id in self.objects
+      ]
+
+    if tool == 'translate':
+      d = np.array([data['dx'], data['dy'], data['dz']])
+      for obj, vert in targets:
+        if vert is None:
+          obj.translate(*d)
+        else:
+          obj.translate_vertex(vert, d)
+    elif tool == 'rotate':
+      q = (data['x'], data['y'], data['z'], data['w'])
+      mid = np.array([data['mx'], data['my'], data['mz']])
+      for obj, vert in targets:
+        if vert is None:
+          d = obj.get_position() - mid
+          obj.translate(*(quat_rotate(q, d) - d))
+          obj.rotate(q)
+        else:
+          d = obj.get_vertex(vert) - mid
+          obj.translate_vertex(vert, quat_rotate(q, d) - d)
+    elif tool == 'scale':
+      s = np.array([data['sx'], data['sy'], data['sz']])
+      mid = np.array([data['mx'], data['my'], data['mz']])
+      for obj, vert in targets:
+        if vert is None:
+          d = obj.get_position() - mid
+          obj.translate(*(d * s - d))
+          obj.scale(*s)
+        else:
+          d = obj.get_vertex(vert) - mid
+          obj.translate_vertex(vert, d * s - d)
+    elif tool == 'delete':
+      for id in data['ids']:
+        self.objects.pop(id, None)
+
+    return True
+
+  def delete_parts_(self, parts):
+    """Deletes vertices, edges & faces of objects."""
+
+    for id, part, kind in parts:
+      obj = self.objects.get(id)
+      if obj is None:
+        continue
+      if kind == 'vertex':
+        obj.delete_vertex(int(part))
+      elif kind == 'edge':
+        obj.delete_edge(int(part))
+      elif kind == 'face':
+        obj.delete_face(int(part))
+
 
   @property
   def __dict__(self):
@@ -110,75 +574,196 @@ class Scene(object):
   def to_stl(self):
     """Converts the scene to STL format."""
 
-    s = StringIO.StringIO()
+    return ''.join(self.iter_stl())
+
+  def iter_stl(self):
+    """Generates the STL file of the scene in chunks."""
+
+    for id, obj in self.objects.iteritems():
+      yield 'solid %s\n' % obj.id
+      for chunk in format_rows(STL_FACET, obj.facets()):
+        yield chunk
+      yield 'endsolid %s\n' % obj.id
+
+  def to_stlb(self):
+    """Converts the scene to binary STL format."""
+
+    return ''.join(self.iter_stlb())
+
+  def iter_stlb(self):
+    """Generates the binary STL file of the scene in chunks."""
+
+    yield 'Exported by Shapy'.ljust(80)
+    yield struct.pack('<I', sum(
+      len(obj.faces) for obj in self.objects.itervalues()
+    ))
+
+    for obj in self.objects.itervalues():
+      facets = obj.facets()
+      for start in xrange(0, len(facets), CHUNK_ROWS):
+        chunk = facets[start:start + CHUNK_ROWS]
+        triangles = np.zeros(len(chunk), dtype=STLB_TRIANGLE)
+        triangles['data'] = chunk
+        yield triangles.tostring()
+
+  def to_buffers(self):
+    """Converts the scene to packed vertex buffers.
+
+    The output starts with the length of a JSON header, followed by the
+    header and the binary data, each of them padded to 4 bytes. The header
+    lists the model matrix of every object, in the order expected by WebGL,
+    and the offsets & lengths in the binary data of its Float32 positions,
+    normals and UVs and of its Uint32 indices.
+    """
+
+    objects, chunks, offset = [], [], 0
+    for id, obj in self.objects.iteritems():
+      views = {}
+      for name, array in sorted(obj.buffers().iteritems()):
+        data = array.tostring()
+        views[name] = { 'offset': offset, 'length': len(data) }
+        chunks.append(data)
+        offset += len(data)
+
+      objects.append(dict(views,
+        id=id,
+        model=np.asarray(obj.model).ravel().tolist()
+      ))
+
+    header = json.dumps({ 'objects': objects })
+    header += ' ' * (-len(header) % 4)
+    return ''.join([struct.pack('<I', len(header)), header] + chunks)
+
+  def to_glb(self, textures={}):
+    """Converts the scene to binary glTF 2.0.
+
+    Objects become nodes which keep their translation, rotation & scale. The
+    textures map holds the MIME type & the encoded image of textures by ID,
+    embedded in the file as they are.
+    """
+
+    gltf = {
+      'asset': { 'version': '2.0', 'generator': 'Shapy' },
+      'scene': 0,
+      'scenes': [{ 'nodes': [] }],
+      'nodes': [],
+      'meshes': [],
+      'materials': [],
+      'textures': [],
+      'images': [],
+      'accessors': [],
+      'bufferViews': [],
+      'buffers': []
+    }
+    chunks = []
+
+    def add_view(data, target=None):
+      """Appends data to the binary chunk, returning its buffer view."""
+
+      offset = sum(len(chunk) for chunk in chunks)
+      view = { 'buffer': 0, 'byteOffset': offset, 'byteLength': len(data) }
+      if target:
+        view['target'] = target
+      chunks.append(data + '\0' * (-len(data) % 4))
+      gltf['bufferViews'].append(view)
+      return len(gltf['bufferViews']) - 1
+
+    def add_accessor(array, type, target):
+      """Stores an array, returning its accessor."""
+
+      accessor = {
+        'bufferView': add_view(array.tostring(), target),
+        'componentType': GLTF_COMPONENTS[array.dtype.str],
+        'count': len(array),
+        'type': type
+      }
+      if type == 'VEC3':
+        accessor['min'] = array.min(axis=0).tolist()
+        accessor['max'] = array.max(axis=0).tolist()
+      gltf['accessors'].append(accessor)
+      return len(gltf['accessors']) - 1
+
+    # Images are only stored once, even if used by several objects.
+    materials = {}
+    for id, (mime, image) in sorted(textures.iteritems()):
+      gltf['images'].append({ 'bufferView': add_view(image), 'mimeType': mime })
+      gltf['textures'].append({ 'source': len(gltf['images']) - 1 })
+      gltf['materials'].append({
+        'pbrMetallicRoughness': {
+          'baseColorTexture': { 'index': len(gltf['textures']) - 1 },
+          'metallicFactor': 0.0
+        }
+      })
+      materials[id] = len(gltf['materials']) - 1
+
     for id, obj in self.objects.iteritems():
-      print >>s, 'solid %s' % obj.id
-
-      for _, v in obj.faces.iteritems():
-        e0 = obj.edges[abs(v[0])]
-        e1 = obj.edges[abs(v[1])]
-        e2 = obj.edges[abs(v[2])]
-        v0 = obj.verts[e0[0] if v[0] >= 0 else e0[1]]
-        v1 = obj.verts[e1[0] if v[1] >= 0 else e1[1]]
-        v2 = obj.verts[e2[0] if v[2] >= 0 else e2[1]]
-
-        v0 = obj.model * Vector4([v0[0], v0[1], v0[2], 1.0])
-        v1 = obj.model * Vector4([v1[0], v1[1], v1[2], 1.0])
-        v2 = obj.model * Vector4([v2[0], v2[1], v2[2], 1.0])
-        a = v1 - v0
-        b = v2 - v0
-        n = Vector3([a.x, a.y, a.z]).cross(Vector3([b.x, b.y, b.z]))
-        n.normalise()
-
-        print >>s, 'facet normal %f %f %f' % (n.x, n.y, n.z)
-        print >>s, 'outer loop'
-        print >>s, 'vertex %f %f %f' % (v0.x, v0.y, v0.z)
-        print >>s, 'vertex %f %f %f' % (v1.x, v1.y, v1.z)
-        print >>s, 'vertex %f %f %f' % (v2.x, v2.y, v2.z)
-        print >>s, 'end loop'
-
-      print >>s, 'endsolid %s' % obj.id
-
-    return s.getvalue()
+      q = np.array([obj.rx, obj.ry, obj.rz, obj.rw], dtype=np.float64)
+      length = np.sqrt((q * q).sum())
+      node = {
+        'name': obj.id,
+        'translation': [obj.tx, obj.ty, obj.tz],
+        'rotation': (q / length).tolist() if length else [0, 0, 0, 1],
+        'scale': [obj.sx, obj.sy, obj.sz]
+      }
+
+      buffers = obj.buffers()
+      if len(buffers['indices']):
+        primitive = {
+          'attributes': {
+            'POSITION': add_accessor(buffers['positions'], 'VEC3', 34962),
+            'NORMAL': add_accessor(buffers['normals'], 'VEC3', 34962),
+            'TEXCOORD_0': add_accessor(buffers['uvs'], 'VEC2', 34962)
+          },
+          'indices': add_accessor(buffers['indices'], 'SCALAR', 34963)
+        }
+        texture = obj.texture and int(obj.texture)
+        if texture in materials:
+          primitive['material'] = materials[texture]
+        gltf['meshes'].append({ 'name': obj.id, 'primitives': [primitive] })
+        node['mesh'] = len(gltf['meshes']) - 1
+
+      gltf['nodes'].append(node)
+      gltf['scenes'][0]['nodes'].append(len(gltf['nodes']) - 1)
+
+    # Empty arrays are not allowed.
+    binary = ''.join(chunks)
+    if binary:
+      gltf['buffers'].append({ 'byteLength': len(binary) })
+    for key, value in gltf.items():
+      if value == []:
+        del gltf[key]
+
+    header = json.dumps(gltf, separators=(',', ':'))
+    header += ' ' * (-len(header) % 4)
+    out = [struct.pack('<II', len(header), 0x4E4F534A), header]
+    if binary:
+      out += [struct.pack('<II', len(binary), 0x004E4942), binary]
+    length = 12 + sum(len(chunk) for chunk in out)
+    return ''.join([struct.pack('<4sII', 'glTF', 2, length)] + out)
 
   def to_obj(self):
     """Converts the scene to wavefront obj format."""
 
+    return ''.join(self.iter_obj())
+
+  def iter_obj(self):
+    """Generates the wavefront obj file of the scene in chunks."""
 
-    s = StringIO.StringIO()
     for id, obj in self.objects.iteritems():
-      print >>s, 'o "%s"' % id
-
-      vmap = {}
-      i = 1
-      for k, v in obj.verts.iteritems():
-        v = obj.model * Vector4([float(v[0]), float(v[1]), float(v[2]), 1.])
-        vmap[k] = i
-        i += 1
-        print >>s, 'v %f %f %f' % (v.x, v.y, v.z)
-
-      uvmap = {}
-      i = 1
-      for k, v in obj.uvPoints.iteritems():
-        uvmap[k] = i
-        i += 1
-        print >>s, 'vt %f %f' % v
-
-      for _, v in obj.faces.iteritems():
-        e0 = obj.edges[abs(v[0])]
-        e1 = obj.edges[abs(v[1])]
-        e2 = obj.edges[abs(v[2])]
-        v0 = vmap[e0[0] if v[0] >= 0 else e0[1]]
-        v1 = vmap[e1[0] if v[1] >= 0 else e1[1]]
-        v2 = vmap[e2[0] if v[2] >= 0 else e2[1]]
-
-        ue0 = obj.uvEdges[abs(v[3])]
-        ue1 = obj.uvEdges[abs(v[4])]
-        ue2 = obj.uvEdges[abs(v[5])]
-        uv0 = uvmap[ue0[0] if v[3] >= 0 else ue0[1]]
-        uv1 = uvmap[ue1[0] if v[4] >= 0 else ue1[1]]
-        uv2 = uvmap[ue2[0] if v[5] >= 0 else ue2[1]]
-
-        print >>s, 'f %d/%d %d/%d %d/%d' % (v0, uv0, v1, uv1, v2, uv2)
-
-    return s.getvalue()
\ No newline at end of file
+      yield 'o "%s"\n' % id
+
+      # Vertices & UV points are numbered in the order they are written.
+      vert_ids, verts = obj.verts.ids, obj.verts.values
+      for chunk in format_rows('v %f %f %f\n', obj.transform(verts)):
+        yield chunk
+
+      uv_ids, uvs = obj.uvPoints.ids, obj.uvPoints.values
+      for chunk in format_rows('vt %f %f\n', uvs):
+        yield chunk
+
+      faces = np.dstack((
+        lookup(vert_ids, obj.face_verts()) + 1,
+        lookup(uv_ids, obj.face_uvs()) + 1
+      )).reshape(-1, 6)
+      for chunk in format_rows('f %d/%d %d/%d %d/%d\n', faces):
+        yield chunk
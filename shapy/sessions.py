@@ -0,0 +1,89 @@
+# This file is part of the Shapy Project.
+# Licensing information can be found in the LICENSE file.
+# (C) 2015 The Shapy Team. All rights reserved.
+
+import collections
+import json
+import time
+
+from tornado.gen import Return, coroutine
+from tornado.ioloop import IOLoop
+
+from shapy.account import Account
+
+
+class Sessions(object):
+  """Cache of the accounts logged in with session tokens.
+
+  Accounts are kept for a short while in a LRU, so most requests do not reach
+  redis. The expiry of a session is refreshed at most once per interval and
+  logouts are announced to all processes through a redis channel.
+  """
+
+  # Channel used to announce logouts.
+  CHANNEL = 'sessions'
+
+  # Number of seconds an account is cached for.
+  TTL = 60
+
+  # Number of seconds between refreshes of the expiry of a session.
+  REFRESH_INTERVAL = 30
+
+  # Maximum number of cached sessions.
+  MAX_SIZE = 4096
+
+  def __init__(self, redis, hub):
+    """Creates an empty cache, listening for logouts."""
+
+    self.redis = redis
+    self.cache = collections.OrderedDict()
+    hub.subscribe(self.CHANNEL, self)
+
+  @coroutine
+  def get(self, token):
+    """Returns the account logged in with a token or None."""
+
+    now = time.time()
+    key = 'session:%s' % token
+
+    entry = self.cache.pop(token, None)
+    if entry is not None and entry[0] > now:
+      expiry, refreshed, account = entry
+      if refreshed + self.REFRESH_INTERVAL <= now:
+        refreshed = now
+        IOLoop.current().spawn_callback(
+            self.redis.expire, key, Account.SESSION_EXPIRE)
+      self.cache[token] = (expiry, refreshed, account)
+      raise Return(account)
+
+    # Map the session ID to a user & refresh expiration.
+    data, _ = yield [
+      self.redis.get(key),
+      self.redis.expire(key, Account.SESSION_EXPIRE)
+    ]
+    if not data:
+      raise Return(None)
+
+    data = json.loads(data)
+    account = Account(
+      data['id'],
+      first_name=data['first_name'],
+      last_name=data['last_name'],
+      email=data['email']
+    )
+
+    self.cache[token] = (now + self.TTL, now, account)
+    while len(self.cache) > self.MAX_SIZE:
+      self.cache.popitem(last=False)
+    raise Return(account)
+
+  def invalidate(self, token):
+    """Drops a session in all processes."""
+
+    self.cache.pop(token, None)
+    return self.redis.publish(self.CHANNEL, json.dumps({ 'token': token }))
+
+  def on_channel(self, packet):
+    """Handles a logout in another process."""
+
+    self.cache.pop(packet.data['token'], None)
@@ -73,7 +73,10 @@ class LogoutHandler(APIHandler):
     """Logs a user out by invalidating the session token."""
 
     token = self.get_secure_cookie('session')
-    self.redis.delete('session:%s' % token, 'user_id')
+    yield [
+      self.redis.delete('session:%s' % token, 'user_id'),
+      self.application.sessions.invalidate(token)
+    ]
     self.clear_all_cookies()
 
 
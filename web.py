@@ -1,21 +1,41 @@
 #!/usr/bin/env python2
 
+import json
 import os
+import socket
 import sys
+import tempfile
+import time
 
-import redis
+import tornadoredis
+import tornado.gen
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 
 import psycopg2
-import momoko
 
+import shapy.acl
 import shapy.editor
+import shapy.exports
+import shapy.hub
+import shapy.live
+import shapy.metrics
 import shapy.user
 import shapy.assets
 import shapy.permissions
+import shapy.pool
 import shapy.public
+import shapy.sessions
+
+
+# Number of seconds between load reports.
+REPORT_INTERVAL = 5
+
+# Number of missed reports after which a worker is considered dead.
+REPORT_MISSED = 3
 
 
 
@@ -29,6 +49,45 @@ class IndexHandler(tornado.web.StaticFileHandler):
 
 
 
+def bind_socket(port):
+  """Creates a listening socket which can be shared by several processes.
+
+  With SO_REUSEPORT, the kernel balances incoming connections between all the
+  worker processes listening on the same port.
+  """
+
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+  sock.setblocking(0)
+  sock.bind(('', port))
+  sock.listen(128)
+  return sock
+
+
+
+@tornado.gen.coroutine
+def report_load(app):
+  """Publishes the load of this worker to redis, pruning dead workers."""
+
+  now = int(time.time())
+  yield app.redis.hset('workers', app.WORKER_ID, json.dumps({
+    'pid': os.getpid(),
+    'time': now,
+    'sockets': len(shapy.editor.WSHandler.sockets),
+    'scenes': len(shapy.live.LiveScene.scenes)
+  }))
+
+  workers = yield app.redis.hgetall('workers')
+  dead = [
+    worker for worker, report in (workers or {}).iteritems()
+    if json.loads(report)['time'] < now - REPORT_INTERVAL * REPORT_MISSED
+  ]
+  if dead:
+    yield app.redis.hdel('workers', *dead)
+
+
+
 def main(args):
   """Entry point of the application.
 
@@ -36,6 +95,20 @@ def main(args):
     args: Command line arguments.
   """
 
+  # Read deployment settings.
+  debug = bool(int(os.environ.get('DEBUG', 0)))
+  workers = int(os.environ.get('WORKERS', 1))
+  port = int(os.environ.get('PORT', 8000))
+
+  # Fork the workers, each of them with its own connections. In debug mode,
+  # a single process is used since code is reloaded on changes.
+  if debug:
+    sockets = tornado.netutil.bind_sockets(port)
+  else:
+    if workers != 1:
+      tornado.process.fork_processes(workers)
+    sockets = [bind_socket(port)]
+
   # Set up URL routes.
   app = tornado.web.Application([
     # API for accessing assets.
@@ -61,6 +134,9 @@ def main(args):
     (r'/api/user$',              shapy.user.InfoHandler),
     (r'/api/user/filter$',       shapy.user.FilterHandler),
 
+    # Metrics of the process.
+    (r'/api/metrics$',           shapy.metrics.MetricsHandler),
+
     # WebSocket handler.
     (r'/api/edit/([0-9]+)',      shapy.editor.WSHandler),
 
@@ -71,7 +147,8 @@ def main(args):
     (r'/img/(.*)',  tornado.web.StaticFileHandler, { 'path': 'client/img' }),
     (r'(.*)',       IndexHandler, { 'path': 'client/index.html' }),
   ],
-    debug=True,
+    debug=debug,
+    log_function=shapy.metrics.log_request,
     cookie_secret=os.environ.get('COOKIE_SECRET'),
     facebook_api_key=os.environ.get('FB_API_KEY'),
     facebook_secret=os.environ.get('FB_SECRET'),
@@ -82,31 +159,86 @@ def main(args):
   )
 
   # Read configuration.
+  app.WORKER_ID = '%s:%d' % (socket.gethostname(), os.getpid())
   app.DB_HOST = os.environ.get('DB_HOST', 'localhost')
   app.DB_NAME = os.environ.get('DB_NAME', 'shapy')
   app.DB_USER = os.environ.get('DB_USER', 'postgres')
   app.DB_PORT = int(os.environ.get('DB_PORT', 5432))
   app.DB_PASS = os.environ.get('DB_PASS', '')
+  app.DB_POOL = int(os.environ.get('DB_POOL', 1))
 
   app.RD_HOST = os.environ.get('RD_HOST', 'localhost')
   app.RD_PORT = int(os.environ.get('RD_PORT', 7759))
   app.RD_PASS = os.environ.get('RD_PASS', '')
+  app.RD_POOL = int(os.environ.get('RD_POOL', 16))
+  app.RD_TIMEOUT = float(os.environ.get('RD_TIMEOUT', 2.0))
+
+  app.EXPORT_DIR = os.environ.get(
+      'EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'shapy-exports'))
+  app.EXPORT_SIZE = int(os.environ.get('EXPORT_SIZE', 256)) * 1024 * 1024
+  app.TEXTURE_CACHE = int(os.environ.get('TEXTURE_CACHE', 64)) * 1024 * 1024
+  app.IMPORT_SIZE = int(os.environ.get('IMPORT_SIZE', 32)) * 1024 * 1024
+  app.CPU_POOL = int(os.environ.get('CPU_POOL', 2))
+  app.CPU_QUEUE = int(os.environ.get('CPU_QUEUE', 16))
+  app.CPU_TIMEOUT = float(os.environ.get('CPU_TIMEOUT', 30.0))
+  app.IMPORT_TIMEOUT = float(os.environ.get('IMPORT_TIMEOUT', 300.0))
+  app.METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
 
   # Connect to the postgresql database.
-  app.db = momoko.Pool(
+  app.db = shapy.pool.DatabasePool(
       cursor_factory=psycopg2.extras.DictCursor,
       dsn='dbname=%s user=%s password=%s host=%s port=%d' %
           (app.DB_NAME, app.DB_USER, app.DB_PASS, app.DB_HOST, app.DB_PORT),
-      size=1)
+      size=app.DB_POOL)
 
   # Connect to the redis server.
-  app.redis = redis.Redis(
+  app.redis = shapy.pool.RedisPool(
       host=app.RD_HOST,
       port=app.RD_PORT,
-      password=app.RD_PASS)
+      password=app.RD_PASS,
+      size=app.RD_POOL,
+      timeout=app.RD_TIMEOUT)
+
+  # Share a single redis subscriber between all websockets.
+  app.hub = shapy.hub.Hub(tornadoredis.Client(
+      host=app.RD_HOST,
+      port=app.RD_PORT,
+      password=app.RD_PASS))
+
+  # Cache permissions, dropping them when changed by any worker.
+  app.acl = shapy.acl.ACL(app.db, app.redis, app.hub)
+
+  # Cache sessions, dropping them when logged out from any worker.
+  app.sessions = shapy.sessions.Sessions(app.redis, app.hub)
+
+  # Run CPU intensive jobs, such as imports & images, in other processes.
+  app.executor = shapy.pool.ProcessPool(
+      size=app.CPU_POOL,
+      max_pending=app.CPU_QUEUE,
+      timeout=app.CPU_TIMEOUT)
+
+  # Cache exported scenes on disk, shared by the workers of the host.
+  app.exports = shapy.exports.ExportCache(app.EXPORT_DIR, app.EXPORT_SIZE)
+
+  # Cache converted textures in memory, spilling them to the export cache.
+  app.textures = shapy.exports.ImageCache(app.exports, app.TEXTURE_CACHE)
+
+  # Periodically write back scenes modified by edits.
+  tornado.ioloop.PeriodicCallback(
+      shapy.live.LiveScene.flush_all,
+      shapy.live.LiveScene.FLUSH_INTERVAL * 1000).start()
+
+  # Measure how responsive the worker is.
+  shapy.metrics.monitor_lag()
+
+  # Report the load of the worker.
+  tornado.ioloop.PeriodicCallback(
+      lambda: tornado.ioloop.IOLoop.current().spawn_callback(report_load, app),
+      REPORT_INTERVAL * 1000).start()
 
   # Start the server.
-  tornado.httpserver.HTTPServer(app).listen(int(os.environ.get('PORT', 8000)))
+  server = tornado.httpserver.HTTPServer(app)
+  server.add_sockets(sockets)
   tornado.ioloop.IOLoop.instance().start()
 
 